@@ -1,17 +1,293 @@
 import os
 from emergentintegrations.llm.chat import LlmChat, UserMessage
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, Optional
 import asyncio
-from database import save_hint, get_quest_by_id
+import hashlib
+import time
+from database import save_hint, find_cached_hint
+from quest_catalog import quest_catalog
+from code_analysis import code_fingerprint
+from cache import TTLCache
+from metrics import LatencyStats
+
+def progress_tier(user_progress: Dict) -> str:
+    """Coarse skill tier used to share hints between similar students"""
+    level = user_progress.get('level', 1)
+    if level <= 2:
+        return "beginner"
+    if level <= 5:
+        return "intermediate"
+    return "advanced"
+
+class LLMUnavailable(Exception):
+    """Raised when the model could not answer within the gateway's time budget"""
+
+class TokenBucket:
+    """Async rate limiter: refills `rate` tokens per second, holds at most `capacity`"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        # Waiters are served in arrival order, one token each
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class GeminiProvider:
+    """Gemini through emergentintegrations
+    
+    Its chat API only returns complete responses, so stream() yields the
+    whole answer as a single chunk.
+    """
+    
+    def __init__(self, api_key: str, model: tuple = ("gemini", "gemini-2.0-flash")):
+        self.api_key = api_key
+        self.model = model
+    
+    async def complete(self, system_message: str, text: str, session_id: str) -> str:
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        )
+        chat.with_model(*self.model)
+        return await chat.send_message(UserMessage(text=text))
+    
+    async def stream(self, system_message: str, text: str, session_id: str) -> AsyncIterator[str]:
+        yield await self.complete(system_message, text, session_id)
+
+class FakeProvider:
+    """Offline stand-in for the model: streams a canned answer word by word
+    
+    Selected with LLM_PROVIDER=fake, for development and tests without an API key.
+    """
+    
+    def __init__(self, token_delay: float = None):
+        self.token_delay = token_delay if token_delay is not None else float(os.getenv("LLM_FAKE_TOKEN_DELAY", 0.05))
+    
+    def _answer(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()[:8]
+        return ("Brave adventurer, take another look at the quest instructions and compare them "
+                "with your code one step at a time. Print your variables to see what they hold! "
+                f"(offline hint {digest})")
+    
+    async def complete(self, system_message: str, text: str, session_id: str) -> str:
+        return "".join([chunk async for chunk in self.stream(system_message, text, session_id)])
+    
+    async def stream(self, system_message: str, text: str, session_id: str) -> AsyncIterator[str]:
+        words = self._answer(text).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.token_delay)
+            yield word if i == len(words) - 1 else word + " "
+
+def make_provider(api_key: Optional[str]):
+    """Model provider selected by LLM_PROVIDER (gemini or fake)"""
+    if os.getenv("LLM_PROVIDER", "gemini") == "fake":
+        return FakeProvider()
+    return GeminiProvider(api_key)
+
+class LLMGateway:
+    """Single way out to the model provider
+    
+    Bounds concurrent calls with a semaphore and the call rate with a token
+    bucket, shares one call between identical in-flight requests, and gives
+    every request a time budget: an attempt that is slower than hedge_after
+    gets a second, parallel attempt, a failed attempt is retried, and the
+    first answer wins.
+    """
+    
+    def __init__(self, provider):
+        self.provider = provider
+        self.timeout = float(os.getenv("LLM_TIMEOUT", 20))
+        self.hedge_after = float(os.getenv("LLM_HEDGE_AFTER", 6))
+        self.max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", 2))
+        self._semaphore = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", 8)))
+        self._bucket = TokenBucket(
+            rate=float(os.getenv("LLM_RATE_PER_SECOND", 4)),
+            capacity=float(os.getenv("LLM_BURST", 8))
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        self.queue_wait = LatencyStats()
+        self.provider_latency = LatencyStats()
+        self.first_chunk_latency = LatencyStats()
+        self.requests = 0
+        self.coalesced = 0
+        self.hedges = 0
+        self.retries = 0
+        self.failures = 0
+        self.timeouts = 0
+    
+    async def complete(self, system_message: str, text: str, session_id: str, key: str = None) -> str:
+        """Send one prompt; requests with the same key share a single call"""
+        key = key or hashlib.sha256(f"{system_message}\0{text}".encode()).hexdigest()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._complete(system_message, text, session_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded, so one caller going away doesn't cancel the call for the others
+        return await asyncio.shield(task)
+    
+    async def _complete(self, system_message: str, text: str, session_id: str) -> str:
+        self.requests += 1
+        deadline = time.monotonic() + self.timeout
+        attempts = {asyncio.ensure_future(self._attempt(system_message, text, session_id))}
+        started = 1
+        last_error = None
+        try:
+            while attempts:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(remaining, self.hedge_after) if started < self.max_attempts else remaining
+                done, attempts = await asyncio.wait(attempts, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                
+                failed = False
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    last_error = attempt.exception()
+                    failed = True
+                
+                if started < self.max_attempts and (failed or not done):
+                    if failed:
+                        self.retries += 1
+                    else:
+                        self.hedges += 1
+                    attempts.add(asyncio.ensure_future(self._attempt(system_message, text, session_id)))
+                    started += 1
+            
+            if attempts:
+                self.timeouts += 1
+                raise LLMUnavailable(f"no answer within {self.timeout}s")
+            raise LLMUnavailable(f"all {started} attempts failed: {last_error}")
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+    
+    async def _attempt(self, system_message: str, text: str, session_id: str) -> str:
+        queued = time.monotonic()
+        async with self._semaphore:
+            await self._bucket.acquire()
+            started = time.monotonic()
+            self.queue_wait.record(started - queued)
+            try:
+                return await self.provider.complete(system_message, text, session_id)
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                self.provider_latency.record(time.monotonic() - started)
+    
+    async def stream(self, system_message: str, text: str, session_id: str) -> AsyncIterator[str]:
+        """Stream the answer to one prompt
+        
+        Limited like complete(), but neither coalesced nor hedged; the
+        timeout applies to the wait for each chunk.
+        """
+        self.requests += 1
+        queued = time.monotonic()
+        async with self._semaphore:
+            await self._bucket.acquire()
+            started = time.monotonic()
+            self.queue_wait.record(started - queued)
+            chunks = self.provider.stream(system_message, text, session_id)
+            first = True
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        self.timeouts += 1
+                        raise LLMUnavailable(f"no output for {self.timeout}s")
+                    if first:
+                        self.first_chunk_latency.record(time.monotonic() - started)
+                        first = False
+                    yield chunk
+            except LLMUnavailable:
+                raise
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                await chunks.aclose()
+                self.provider_latency.record(time.monotonic() - started)
+    
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "hedges": self.hedges,
+            "retries": self.retries,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "in_flight": len(self._inflight),
+            "queue_wait": self.queue_wait.summary(),
+            "provider_latency": self.provider_latency.summary(),
+            "first_chunk_latency": self.first_chunk_latency.summary()
+        }
 
 class AIHintGenerator:
     def __init__(self):
         self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
+        self.provider = make_provider(self.api_key)
+        if not self.api_key and not isinstance(self.provider, FakeProvider):
             print("Warning: GEMINI_API_KEY not set, AI hints will be disabled")
             self.enabled = False
         else:
             self.enabled = True
+        self.gateway = LLMGateway(self.provider)
+        
+        # Hints keyed by quest, code structure and progress tier; db.hints backs the in-memory LRU
+        self.hint_ttl = float(os.getenv("HINT_CACHE_TTL", 7 * 24 * 3600))
+        self.hint_cache = TTLCache(maxsize=int(os.getenv("HINT_CACHE_SIZE", 2048)), ttl=self.hint_ttl)
+        self.store_hits = 0
+        self.store_misses = 0
+        # Hint generations in flight by cache key, so coalesced requests save one hint
+        self._generating: Dict[str, asyncio.Future] = {}
+    
+    def hint_cache_key(self, quest_id: str, user_code: str, user_progress: Dict) -> str:
+        return f"{quest_id}:{progress_tier(user_progress)}:{code_fingerprint(user_code)}"
+    
+    def cache_stats(self) -> Dict:
+        """Hit rates of the in-memory and stored hint caches"""
+        memory = self.hint_cache.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.store_hits
+        return {
+            "memory": memory,
+            "store_hits": self.store_hits,
+            "store_misses": self.store_misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+    
+    async def _cached_hint(self, cache_key: str) -> Optional[str]:
+        cached = self.hint_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        cached = await find_cached_hint(cache_key, self.hint_ttl)
+        if cached is not None:
+            self.store_hits += 1
+            self.hint_cache.set(cache_key, cached)
+            return cached
+        self.store_misses += 1
+        return None
     
     async def generate_hint(self, quest_id: str, user_code: str, user_progress: Dict) -> str:
         """Generate an AI-powered hint for the user"""
@@ -20,41 +296,92 @@ class AIHintGenerator:
         
         try:
             # Get quest information
-            quest = await get_quest_by_id(quest_id)
+            quest = quest_catalog.get(quest_id)
             if not quest:
                 return "Sorry, I couldn't find information about this quest."
             
-            # Create a new chat instance for this hint request
-            chat = LlmChat(
-                api_key=self.api_key,
-                session_id=f"hint_{quest_id}_{user_progress.get('user_id', 'guest')}",
-                system_message=self._get_system_message()
-            )
-            
-            # Configure to use Gemini
-            chat.with_model("gemini", "gemini-2.0-flash")
+            # Students on the same template or near-identical code share hints
+            cache_key = self.hint_cache_key(quest_id, user_code, user_progress)
+            cached = await self._cached_hint(cache_key)
+            if cached is not None:
+                return cached
             
-            # Create the hint request
-            hint_request = self._create_hint_request(quest, user_code, user_progress)
-            
-            # Generate hint
-            user_message = UserMessage(text=hint_request)
-            response = await chat.send_message(user_message)
-            
-            # Save the hint to database
-            await save_hint(
-                user_id=user_progress.get('user_id', 'guest'),
-                quest_id=quest_id,
-                hint_text=response,
-                context=user_code
-            )
-            
-            return response
+            # Concurrent requests with the same cache key share one call and one saved hint
+            task = self._generating.get(cache_key)
+            if task is None:
+                task = asyncio.ensure_future(self._generate_hint(cache_key, quest_id, quest, user_code, user_progress))
+                self._generating[cache_key] = task
+                task.add_done_callback(lambda _: self._generating.pop(cache_key, None))
+            # Shielded, so one caller going away doesn't cancel the hint for the others
+            return await asyncio.shield(task)
             
         except Exception as e:
             print(f"Error generating hint: {e}")
             return "Sorry, I couldn't generate a hint right now. Please try again later."
     
+    async def _generate_hint(self, cache_key: str, quest_id: str, quest: Dict, user_code: str, user_progress: Dict) -> str:
+        """Ask the model for a hint and save it, once per cache key in flight"""
+        response = await self.gateway.complete(
+            self._get_system_message(),
+            self._create_hint_request(quest, user_code, user_progress),
+            session_id=f"hint_{quest_id}_{user_progress.get('user_id', 'guest')}",
+            key=cache_key
+        )
+        
+        # Save the hint to database
+        await save_hint(
+            user_id=user_progress.get('user_id', 'guest'),
+            quest_id=quest_id,
+            hint_text=response,
+            context=user_code,
+            cache_key=cache_key
+        )
+        self.hint_cache.set(cache_key, response)
+        return response
+    
+    async def stream_hint(self, quest_id: str, user_code: str, user_progress: Dict) -> AsyncIterator[str]:
+        """Yield a hint in chunks as the model produces it, saving it once complete"""
+        if not self.enabled:
+            yield "AI hints are currently unavailable. Please check your code and try different approaches based on the quest instructions."
+            return
+        
+        quest = quest_catalog.get(quest_id)
+        if not quest:
+            yield "Sorry, I couldn't find information about this quest."
+            return
+        
+        cache_key = self.hint_cache_key(quest_id, user_code, user_progress)
+        cached = await self._cached_hint(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        try:
+            async for chunk in self.gateway.stream(
+                self._get_system_message(),
+                self._create_hint_request(quest, user_code, user_progress),
+                session_id=f"hint_{quest_id}_{user_progress.get('user_id', 'guest')}"
+            ):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            print(f"Error streaming hint: {e}")
+            if chunks:
+                raise
+            yield "Sorry, I couldn't generate a hint right now. Please try again later."
+            return
+        
+        response = "".join(chunks)
+        await save_hint(
+            user_id=user_progress.get('user_id', 'guest'),
+            quest_id=quest_id,
+            hint_text=response,
+            context=user_code,
+            cache_key=cache_key
+        )
+        self.hint_cache.set(cache_key, response)
+    
     def _get_system_message(self) -> str:
         """Get the system message for the AI assistant"""
         return """You are a helpful Python programming tutor for CodeQuest, a gamified learning platform. 
@@ -103,18 +430,26 @@ Please provide a helpful hint to guide this user toward completing the quest. Fo
     
     async def generate_explanation(self, quest_id: str, concept: str) -> str:
         """Generate an explanation for a specific Python concept"""
+        if not self.enabled:
+            return self.fallback_explanation(concept)
+        
+        explanation = await self.request_explanation(concept, session_id=f"explanation_{quest_id}_{concept}")
+        if explanation is None:
+            return self.fallback_explanation(concept)
+        return explanation
+    
+    def fallback_explanation(self, concept: str) -> str:
+        """What to show when no explanation could be generated"""
         if not self.enabled:
             return f"AI explanations are currently unavailable. Please search for '{concept}' in Python documentation."
+        return "Sorry, I couldn't generate an explanation right now. Please try again later."
+    
+    async def request_explanation(self, concept: str, session_id: str = None) -> Optional[str]:
+        """Ask the model to explain a concept; None when AI is disabled or the call fails"""
+        if not self.enabled:
+            return None
         
         try:
-            chat = LlmChat(
-                api_key=self.api_key,
-                session_id=f"explanation_{quest_id}_{concept}",
-                system_message=self._get_explanation_system_message()
-            )
-            
-            chat.with_model("gemini", "gemini-2.0-flash")
-            
             explanation_request = f"""
             Please explain the Python concept: {concept}
             
@@ -127,14 +462,16 @@ Please provide a helpful hint to guide this user toward completing the quest. Fo
             Keep it engaging with a fantasy/adventure theme where appropriate.
             """
             
-            user_message = UserMessage(text=explanation_request)
-            response = await chat.send_message(user_message)
-            
-            return response
+            return await self.gateway.complete(
+                self._get_explanation_system_message(),
+                explanation_request,
+                session_id=session_id or f"explanation_{concept}",
+                key=f"explanation:{concept}"
+            )
             
         except Exception as e:
             print(f"Error generating explanation: {e}")
-            return "Sorry, I couldn't generate an explanation right now. Please try again later."
+            return None
     
     def _get_explanation_system_message(self) -> str:
         """Get system message for concept explanations"""
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import TTLCache
+
+# Mongo error code of a duplicate key; concurrent upserts of the same blob can race into it
+DUPLICATE_KEY = 11000
+
+def _encode(text: str) -> bytes:
+    """UTF-8 bytes of a text body; lone surrogates (possible in program output) become '?'"""
+    return text.encode("utf-8", "replace")
+
+def blob_key(text: str) -> str:
+    """Content address of a text body"""
+    return hashlib.sha256(_encode(text)).hexdigest()
+
+class BlobStore:
+    """Text bodies stored once per content hash, zlib-compressed
+
+    Documents are {_id: sha256 of the text, data: compressed UTF-8, size:
+    uncompressed bytes}. Bodies are immutable, so writes are idempotent
+    upserts and recently written keys are skipped altogether.
+    """
+
+    def __init__(self, collection, known_size: int = None):
+        self.collection = collection
+        self.level = int(os.getenv("BLOB_COMPRESSION_LEVEL", 6))
+        self._known = TTLCache(maxsize=known_size or int(os.getenv("BLOB_KNOWN_KEYS", 50000)))
+
+    async def put_many(self, texts: Iterable[str]) -> List[str]:
+        """Store every text that isn't stored yet; returns their keys in order"""
+        keys = []
+        upserts = {}
+        for text in texts:
+            key = blob_key(text)
+            keys.append(key)
+            if key in upserts or self._known.get(key):
+                continue
+            data = _encode(text)
+            upserts[key] = UpdateOne(
+                {"_id": key},
+                {"$setOnInsert": {
+                    "data": zlib.compress(data, self.level),
+                    "size": len(data),
+                    "created_at": datetime.utcnow()
+                }},
+                upsert=True
+            )
+
+        if upserts:
+            try:
+                await self.collection.bulk_write(list(upserts.values()), ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    raise
+            for key in upserts:
+                self._known.set(key, True)
+        return keys
+
+    async def put(self, text: str) -> str:
+        return (await self.put_many([text]))[0]
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Texts by key; keys that aren't stored are left out"""
+        texts = {}
+        async for blob in self.collection.find({"_id": {"$in": list(set(keys))}}, {"data": 1}):
+            texts[blob["_id"]] = zlib.decompress(blob["data"]).decode()
+        return texts
+
+    async def get(self, key: str) -> Optional[str]:
+        return (await self.get_many([key])).get(key)
@@ -0,0 +1,148 @@
+import ast
+import hashlib
+from typing import Callable, Dict, List
+
+# Node types counted by the collector, used by control-flow checks
+COUNTED_NODES = (
+    ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While,
+    ast.Try, ast.With, ast.comprehension, ast.Return,
+    ast.ClassDef, ast.Lambda,
+)
+
+class CodeFacts:
+    """Everything quest checks need to know about a submission, gathered in one traversal"""
+
+    def __init__(self):
+        self.assignments: Dict[str, str] = {}  # variable name -> type of the assigned value
+        self.calls: Dict[str, int] = {}  # called function name -> number of calls
+        self.node_counts: Dict[str, int] = {}  # node type name (If, For, While, ...) -> count
+        self.functions: Dict[str, int] = {}  # function name -> number of positional parameters
+
+    def count(self, node_type: str) -> int:
+        return self.node_counts.get(node_type, 0)
+
+class FactCollector(ast.NodeVisitor):
+    """Single-pass visitor that fills a CodeFacts instance"""
+
+    def __init__(self):
+        self.facts = CodeFacts()
+
+    def visit(self, node: ast.AST):
+        if isinstance(node, COUNTED_NODES):
+            name = type(node).__name__
+            self.facts.node_counts[name] = self.facts.node_counts.get(name, 0) + 1
+        return super().visit(node)
+
+    def visit_Assign(self, node: ast.Assign):
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                self.facts.assignments[target.id] = self._value_type(node.value)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign):
+        if node.value is not None and isinstance(node.target, ast.Name):
+            self.facts.assignments[node.target.id] = self._value_type(node.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Name):
+            self.facts.calls[node.func.id] = self.facts.calls.get(node.func.id, 0) + 1
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        self.facts.functions[node.name] = len(node.args.posonlyargs) + len(node.args.args)
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _value_type(self, value: ast.AST) -> str:
+        """Python type name for literals, AST node name for everything else"""
+        if isinstance(value, ast.Constant):
+            return type(value.value).__name__
+        return type(value).__name__
+
+def analyze(tree: ast.AST) -> CodeFacts:
+    """Collect the facts of a parsed submission"""
+    collector = FactCollector()
+    collector.visit(tree)
+    return collector.facts
+
+def code_fingerprint(code: str) -> str:
+    """Hash of a program's structure, ignoring comments, blank lines and formatting
+
+    Falls back to the whitespace-normalized text for code that doesn't parse.
+    """
+    try:
+        canonical = ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        canonical = "\n".join(line.strip() for line in code.splitlines() if line.strip())
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class StaticCheck:
+    """A declarative quest check: a description, its points and a predicate over CodeFacts"""
+
+    def __init__(self, description: str, points: int, predicate: Callable[[CodeFacts], bool]):
+        self.description = description
+        self.points = points
+        self.predicate = predicate
+
+    def run(self, facts: CodeFacts) -> Dict:
+        return {
+            "description": self.description,
+            "passed": bool(self.predicate(facts)),
+            "points": self.points
+        }
+
+# Predicate builders
+def defines_variable(name: str, value_type: str = None) -> Callable[[CodeFacts], bool]:
+    def predicate(facts: CodeFacts) -> bool:
+        if name not in facts.assignments:
+            return False
+        return value_type is None or facts.assignments[name] == value_type
+    return predicate
+
+def calls(name: str, at_least: int = 1) -> Callable[[CodeFacts], bool]:
+    return lambda facts: facts.calls.get(name, 0) >= at_least
+
+def uses(node_type: str, at_least: int = 1) -> Callable[[CodeFacts], bool]:
+    return lambda facts: facts.count(node_type) >= at_least
+
+def defines_function(name: str, arity: int = None) -> Callable[[CodeFacts], bool]:
+    def predicate(facts: CodeFacts) -> bool:
+        if name not in facts.functions:
+            return False
+        return arity is None or facts.functions[name] == arity
+    return predicate
+
+# Static checks per quest
+QUEST_CHECKS: Dict[str, List[StaticCheck]] = {
+    "basic-1": [
+        StaticCheck("Check if name variable is defined", 10, defines_variable("name")),
+        StaticCheck("Check if age variable is defined", 10, defines_variable("age")),
+        StaticCheck("Check if height variable is defined", 10, defines_variable("height")),
+        StaticCheck("Check if is_student variable is defined", 10, defines_variable("is_student")),
+        StaticCheck("Check if variables are printed", 10, calls("print", at_least=4)),
+    ],
+    "basic-2": [
+        StaticCheck("Check for if statement", 15, uses("If")),
+        StaticCheck("Check for for loop", 15, uses("For")),
+        StaticCheck("Check for while loop", 15, uses("While")),
+        StaticCheck("Check for proper loop structure", 15, calls("range")),
+    ],
+    "basic-3": [
+        StaticCheck("Check for greet_user function", 20, defines_function("greet_user")),
+        StaticCheck("Check for calculate_area function", 20, defines_function("calculate_area")),
+        StaticCheck("Check for is_even function", 20, defines_function("is_even")),
+        StaticCheck("Check for find_max function", 20, defines_function("find_max")),
+    ],
+}
+
+# Used for quests without registered checks
+DEFAULT_CHECKS = [
+    StaticCheck("Code syntax check", 50, lambda facts: True),
+]
+
+def run_static_checks(facts: CodeFacts, quest_id: str) -> List[Dict]:
+    """Evaluate the checks registered for a quest against precomputed facts"""
+    checks = QUEST_CHECKS.get(quest_id, DEFAULT_CHECKS)
+    return [check.run(facts) for check in checks]
@@ -4,60 +4,647 @@ import tempfile
 import os
 import time
 import uuid
-from typing import Dict, List, Tuple
+from types import CodeType
+from typing import AsyncIterator, Dict, List, Tuple
 import ast
-import re
-from io import StringIO
-from contextlib import redirect_stdout, redirect_stderr
+import json
+import hashlib
+import math
+import select
+import signal
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from cache import TTLCache
+from code_analysis import analyze, run_static_checks
+from code_policy import ALLOWED_MODULES, check_policy
+from quest_harness import QuestHarness
+from sandbox_io import OutputBuffer, make_import, make_print
+
+# Outputs of runs that depend on machine load or state rather than on the code
+UNCACHEABLE_OUTPUTS = ("Execution error", "Error: Memory limit exceeded", "Error: Sandbox")
+
+class ExecutorSaturated(Exception):
+    """Raised when the sandbox pool has no free worker or queue slot"""
+    pass
+
+class SandboxPool:
+    """Pool of pre-forked worker processes that run submissions off the event loop"""
+
+    def __init__(self, workers: int = None, max_queue: int = None, start_method: str = None):
+        self.workers = workers or int(os.getenv("CODE_EXECUTOR_WORKERS", os.cpu_count() or 2))
+        if max_queue is None:
+            max_queue = int(os.getenv("CODE_EXECUTOR_QUEUE_SIZE", self.workers * 4))
+        self.max_queue = max_queue
+        # None forks (cheap, but only safe before the process starts other threads)
+        self.start_method = start_method
+        self._executor = None
+        self._in_flight = 0
+        # Sandbox children forked outside the pool (streaming runs) share the workers' budget
+        self._running = asyncio.Semaphore(self.workers)
+
+    @property
+    def capacity(self) -> int:
+        """Jobs that may be running or waiting before new ones are rejected"""
+        return self.workers + self.max_queue
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def start(self):
+        """Fork the worker processes up front so the first requests don't pay for it"""
+        if self._executor is not None:
+            return
+        if self.start_method:
+            context = multiprocessing.get_context(self.start_method)
+        elif "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        warm_up = [self._executor.submit(_warm_up) for _ in range(self.workers)]
+        for future in warm_up:
+            future.result()
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @contextmanager
+    def reserve(self):
+        """Hold one pool slot, or raise ExecutorSaturated if the queue is full"""
+        if self._in_flight >= self.capacity:
+            raise ExecutorSaturated(f"All {self.workers} sandbox workers are busy and the queue is full")
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    @asynccontextmanager
+    async def run_slot(self):
+        """Wait until fewer than `workers` streaming runs are executing, then hold a turn"""
+        async with self._running:
+            yield
+
+    async def submit(self, fn, *args):
+        """Run fn(*args) in a worker, or raise ExecutorSaturated if the queue is full"""
+        with self.reserve():
+            if self._executor is None:
+                self.start()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+class FrameTooLarge(ValueError):
+    """Raised in the sandbox child for a frame the parent would refuse to read"""
+    pass
+
+class FrameWriter:
+    """Sends newline-delimited JSON frames from the sandbox child to its parent
+
+    Frames are an initial {"type": "start", "rss": ...}, {"type": "stdout",
+    "data": ...}, {"type": "test", "result": ...} and a final {"type": "run",
+    "run": ...}. Stdout is batched so a print-heavy
+    loop costs a write per chunk rather than per print; an interval timer flushes
+    whatever is pending while the program computes silently. A blocking write is
+    the backpressure: a slow reader pauses the child. Frames longer than
+    max_frame_bytes are never written, they raise FrameTooLarge instead.
+    """
+
+    def __init__(self, fd: int, max_frame_bytes: int, flush_bytes: int = 1024, flush_interval: float = 0.05):
+        self.fd = fd
+        self.max_frame_bytes = max_frame_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_size = 0
+        self._busy = False
+
+    def start_timer(self):
+        """Flush pending stdout every flush_interval seconds (child process only)"""
+        signal.signal(signal.SIGALRM, self._on_timer)
+        signal.setitimer(signal.ITIMER_REAL, self.flush_interval, self.flush_interval)
+
+    def stop_timer(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def _on_timer(self, signum, frame):
+        # Skip this tick if the interrupted code is itself writing
+        if not self._busy:
+            self.flush_stdout()
+
+    def stdout(self, text: str):
+        self._busy = True
+        try:
+            self._pending.append(text)
+            self._pending_size += len(text)
+            if self._pending_size >= self.flush_bytes:
+                self.flush_stdout()
+        finally:
+            self._busy = False
+
+    def flush_stdout(self):
+        if self._pending:
+            data = "".join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self._write({"type": "stdout", "data": data})
+
+    def send(self, frame: Dict):
+        self._busy = True
+        try:
+            self.flush_stdout()
+            self._write(frame)
+        finally:
+            self._busy = False
+
+    def _write(self, frame: Dict):
+        data = json.dumps(frame).encode() + b"\n"
+        if len(data) > self.max_frame_bytes:
+            raise FrameTooLarge(f"{frame['type']} frame of {len(data)} bytes exceeds the limit")
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+def _warm_up() -> int:
+    """No-op job used to make sure every worker process is forked"""
+    return os.getpid()
+
+def _pool_execute(code: str, quest_id: str, test_cases: List[Dict] = None) -> Dict:
+    """Entry point for pool workers, runs on the worker's copy of the executor
+
+    The result cache is consulted by the parent before dispatching, so workers skip it.
+    """
+    return code_executor._execute_uncached(code, quest_id, test_cases)
+
+def _max_rss() -> int:
+    """Peak RSS of the current process so far, in ru_maxrss units"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _fingerprint(value) -> str:
+    """Stable hash of a JSON-like value"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+class Submission:
+    """A submission parsed, compiled and analyzed once, shared by the run and every grader"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tree = ast.parse(source, "<string>")
+        self.violations = check_policy(self.tree)
+        self.code_object = compile(self.tree, "<string>", "exec")
+        self.facts = analyze(self.tree)
 
 class CodeExecutor:
-    def __init__(self):
+    def __init__(self, pool: SandboxPool = None, isolation: str = None):
         self.timeout = 10  # 10 seconds timeout
         self.max_memory = 100 * 1024 * 1024  # 100MB memory limit
+        self.max_output_bytes = int(os.getenv("CODE_EXECUTOR_MAX_OUTPUT_BYTES", 64 * 1024))
+        # The final frame carries the whole (capped) output, so allow frames well above it
+        self.max_frame_bytes = self.max_output_bytes * 8 + 65536
+        self.pool = pool or SandboxPool()
+        # "subprocess" runs each submission in a forked child with rlimits and a hard kill,
+        # "inline" runs it in the current process (only for platforms without fork)
+        default_isolation = "subprocess" if hasattr(os, "fork") else "inline"
+        self.isolation = isolation or os.getenv("CODE_EXECUTOR_ISOLATION", default_isolation)
+        # Compiled test harnesses keyed by (quest_id, test case fingerprint)
+        self._harness_cache: Dict[Tuple[str, str], QuestHarness] = {}
+        # Results of deterministic runs keyed by (quest_id, code hash, test case fingerprint).
+        # Lives in the process that owns the pool, so every worker benefits from it.
+        self.result_cache = TTLCache(
+            maxsize=int(os.getenv("CODE_RESULT_CACHE_SIZE", 4096)),
+            ttl=float(os.getenv("CODE_RESULT_CACHE_TTL", 3600))
+        )
+        # Parsed and compiled submissions keyed by code hash, per process
+        self._submission_cache = TTLCache(maxsize=int(os.getenv("CODE_COMPILE_CACHE_SIZE", 512)))
+        
+    def start_pool(self):
+        """Pre-fork the sandbox workers"""
+        self.pool.start()
+    
+    def shutdown_pool(self):
+        """Stop the sandbox workers"""
+        self.pool.shutdown()
+    
+    async def execute_code_async(self, code: str, quest_id: str, test_cases: List[Dict] = None) -> Dict:
+        """Execute code on the worker pool without blocking the event loop"""
+        key = self._result_key(code, quest_id, test_cases)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
         
-    def execute_code(self, code: str, quest_id: str) -> Dict:
-        """Execute Python code safely and return results"""
+        result = await self.pool.submit(_pool_execute, code, quest_id, test_cases)
+        return self._store_result(key, result)
+    
+    def execute_code(self, code: str, quest_id: str, test_cases: List[Dict] = None) -> Dict:
+        """Execute Python code safely and return results
+        
+        test_cases are the quest's stored test cases; the executable ones run
+        in the submission's namespace right after the code itself.
+        """
+        key = self._result_key(code, quest_id, test_cases)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        
+        return self._store_result(key, self._execute_uncached(code, quest_id, test_cases))
+    
+    def cache_stats(self) -> Dict:
+        """Hit/miss counters of the executor caches"""
+        return {
+            "results": self.result_cache.stats(),
+            "compiled": self._submission_cache.stats()
+        }
+    
+    def _result_key(self, code: str, quest_id: str, test_cases: List[Dict]) -> Tuple[str, str, str]:
+        """Content address of a submission: quest, normalized code and the tests it is graded by"""
+        code_hash = hashlib.sha256(self._clean_code(code).encode()).hexdigest()
+        return (quest_id, code_hash, _fingerprint(test_cases or []))
+    
+    def _store_result(self, key: Tuple[str, str, str], result: Dict) -> Dict:
+        """Cache a fresh result if the run was deterministic"""
+        if not result["timed_out"] and not result["output"].startswith(UNCACHEABLE_OUTPUTS):
+            self.result_cache.set(key, result)
+        return dict(result, cached=False)
+    
+    def _get_submission(self, code: str) -> Submission:
+        """Parse and compile code, reusing an earlier compilation of identical code"""
+        code_hash = hashlib.sha256(code.encode()).hexdigest()
+        submission = self._submission_cache.get(code_hash)
+        if submission is None:
+            submission = Submission(code)
+            self._submission_cache.set(code_hash, submission)
+        return submission
+    
+    def _execute_uncached(self, code: str, quest_id: str, test_cases: List[Dict] = None) -> Dict:
+        """Clean, check, run and grade a submission"""
         try:
-            # Clean and validate code
-            cleaned_code = self._clean_code(code)
-            
-            # Check for dangerous operations
-            if not self._is_safe_code(cleaned_code):
-                return {
-                    "success": False,
-                    "output": "Code contains potentially dangerous operations",
-                    "execution_time": 0,
-                    "test_results": []
-                }
+            submission, rejection = self._prepare(code)
+            if rejection is not None:
+                return rejection
             
-            # Execute code
+            # Execute code once, together with the quest's runtime tests
+            harness = self._get_harness(quest_id, test_cases)
             start_time = time.time()
-            output, error = self._execute_in_sandbox(cleaned_code)
+            if self.isolation == "subprocess":
+                run = self._execute_in_subprocess(submission.code_object, harness)
+            else:
+                run = self._execute_inline(submission.code_object, harness)
             execution_time = time.time() - start_time
             
-            # Run tests
-            test_results = self._run_tests(cleaned_code, quest_id)
+            # Static checks reuse the tree analyzed above, runtime results came back with the run
+            return self._assemble_result(self._run_tests(submission, quest_id), run, execution_time)
+            
+        except Exception as e:
+            return self._error_result(f"Execution error: {str(e)}")
+    
+    async def stream_code(self, code: str, quest_id: str, test_cases: List[Dict] = None) -> AsyncIterator[Dict]:
+        """Execute code and yield frames as they are produced
+        
+        Yields {"type": "stdout", "data": ...} chunks and {"type": "test", "result": ...}
+        per test, then one {"type": "summary", "result": ...} with the full result,
+        whose output is the complete (capped) output of the run.
+        The sandbox child is forked from the calling process; a pool slot is held
+        for the whole run, so ExecutorSaturated is raised before the first frame.
+        At most pool.workers children run at once, the other admitted runs wait
+        for a turn. Parsing, compiling and the static checks run in a thread.
+        """
+        key = self._result_key(code, quest_id, test_cases)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            for frame in self._replay(dict(cached, cached=True)):
+                yield frame
+            return
+        
+        with self.pool.reserve():
+            submission, rejection = await asyncio.to_thread(self._prepare, code)
+            if rejection is not None:
+                for frame in self._replay(self._store_result(key, rejection)):
+                    yield frame
+                return
             
-            # Determine success
-            success = error is None and all(test["passed"] for test in test_results)
+            static_results = await asyncio.to_thread(self._run_tests, submission, quest_id)
+            for result in static_results:
+                yield {"type": "test", "result": result}
             
-            return {
-                "success": success,
-                "output": output if error is None else f"Error: {error}",
-                "execution_time": execution_time,
-                "test_results": test_results
-            }
+            harness = await asyncio.to_thread(self._get_harness, quest_id, test_cases)
+            async with self.pool.run_slot():
+                start_time = time.time()
+                if self.isolation != "subprocess":
+                    run = await asyncio.to_thread(self._execute_inline, submission.code_object, harness)
+                    if run["output"]:
+                        yield {"type": "stdout", "data": run["output"]}
+                    for result in run["test_results"]:
+                        yield {"type": "test", "result": result}
+                else:
+                    run = None
+                    async for frame in self._stream_subprocess(submission.code_object, harness):
+                        if frame["type"] == "run":
+                            run = frame["run"]
+                        else:
+                            yield frame
+                    if not run["streamed"]:
+                        # The child died before reporting, its runtime tests were never sent
+                        for result in run["test_results"]:
+                            yield {"type": "test", "result": result}
+                execution_time = time.time() - start_time
             
-        except Exception as e:
-            return {
-                "success": False,
-                "output": f"Execution error: {str(e)}",
-                "execution_time": 0,
-                "test_results": []
-            }
+            result = self._store_result(key, self._assemble_result(static_results, run, execution_time))
+            yield {"type": "summary", "result": result}
+    
+    def _replay(self, result: Dict) -> List[Dict]:
+        """Frames for a result that is already complete, e.g. a cache hit"""
+        frames = [{"type": "test", "result": test} for test in result["test_results"]]
+        frames.append({"type": "summary", "result": result})
+        return frames
+    
+    def _prepare(self, code: str) -> Tuple[Submission, Dict]:
+        """Clean, parse and policy-check code; returns the submission or a rejection result"""
+        # Clean and validate code
+        cleaned_code = self._clean_code(code)
+        
+        # Parse, policy-check, compile and analyze exactly once
+        try:
+            submission = self._get_submission(cleaned_code)
+        except SyntaxError as e:
+            return None, self._error_result(f"Error: {e}", [{
+                "description": "Syntax Error",
+                "passed": False,
+                "points": 0,
+                "message": str(e)
+            }])
+        
+        # Check for dangerous operations
+        if submission.violations:
+            details = "\n".join(
+                f"Line {violation['line']}: {violation['message']}" for violation in submission.violations
+            )
+            return None, self._error_result(
+                f"Code contains potentially dangerous operations\n{details}",
+                violations=submission.violations
+            )
+        
+        return submission, None
+    
+    def _assemble_result(self, static_results: List[Dict], run: Dict, execution_time: float) -> Dict:
+        """Combine static checks and a finished run into the API result"""
+        output, error = run["output"], run["error"]
+        if run["output_truncated"]:
+            output += f"\n... output truncated at {self.max_output_bytes} bytes ..."
+        
+        test_results = static_results + run["test_results"]
+        
+        # Determine success
+        success = error is None and all(test["passed"] for test in test_results)
+        
+        return {
+            "success": success,
+            "output": output if error is None else f"Error: {error}",
+            "execution_time": execution_time,
+            "test_results": test_results,
+            "violations": [],
+            "output_truncated": run["output_truncated"],
+            "timed_out": run["timed_out"],
+            "peak_memory_bytes": run["peak_memory_bytes"],
+            "cpu_time": run["cpu_time"]
+        }
+    
+    def _error_result(self, output: str, test_results: List[Dict] = None, violations: List[Dict] = None) -> Dict:
+        """Result for a submission that was rejected before it ran"""
+        return {
+            "success": False,
+            "output": output,
+            "execution_time": 0,
+            "test_results": test_results or [],
+            "violations": violations or [],
+            "output_truncated": False,
+            "timed_out": False,
+            "peak_memory_bytes": None,
+            "cpu_time": 0
+        }
+    
+    def _get_harness(self, quest_id: str, test_cases: List[Dict]) -> QuestHarness:
+        """Return the compiled test harness for a quest, compiling it on first use"""
+        if not test_cases:
+            return None
+        
+        key = (quest_id, _fingerprint(test_cases))
+        harness = self._harness_cache.get(key)
+        if harness is None:
+            harness = QuestHarness(test_cases)
+            self._harness_cache[key] = harness
+        return harness
+    
+    def _execute_inline(self, code: CodeType, harness: QuestHarness = None) -> Dict:
+        """Execute code in the current process, without resource limits"""
+        cpu_start = time.process_time()
+        run = self._execute_in_sandbox(code, harness)
+        run.update({
+            "timed_out": False,
+            "peak_memory_bytes": None,
+            "cpu_time": time.process_time() - cpu_start
+        })
+        return run
+    
+    def _spawn_child(self, code: CodeType, harness: QuestHarness, stream: bool) -> Tuple[int, int]:
+        """Fork the sandbox child; returns its pid and the read end of its frame pipe"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        
+        if pid == 0:
+            # Child: never return into the caller's stack, always leave via os._exit
+            exit_code = 0
+            try:
+                os.close(read_fd)
+                # The server's secrets live in its environment; user code has no business reading them
+                os.environ.clear()
+                frames = FrameWriter(write_fd, self.max_frame_bytes)
+                # What the child inherited from the server, so the parent can report only what the run added
+                frames.send({"type": "start", "rss": _max_rss()})
+                self._apply_limits()
+                if stream:
+                    frames.start_timer()
+                run = self._execute_in_sandbox(code, harness, frames if stream else None)
+                frames.stop_timer()
+                try:
+                    frames.send({"type": "run", "run": run})
+                except FrameTooLarge as e:
+                    frames.send({"type": "run", "run": self._failed_run(f"Sandbox error: {e}", harness)})
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        
+        os.close(write_fd)
+        return pid, read_fd
+    
+    def _finish_run(self, run: Dict, exit_status: int, usage, start_rss: int, timed_out: bool, harness: QuestHarness) -> Dict:
+        """Turn the child's last frame and its rusage into a run dict
+        
+        peak_memory_bytes is how far the child's peak RSS rose above what it
+        inherited at fork (start_rss, None if the child never reported it).
+        """
+        # RLIMIT_CPU delivers SIGXCPU, which counts as a timeout as well
+        if os.WIFSIGNALED(exit_status) and os.WTERMSIG(exit_status) == getattr(signal, "SIGXCPU", None):
+            timed_out = True
+        
+        if timed_out:
+            run = self._failed_run(f"Time limit exceeded ({self.timeout} seconds)", harness)
+        elif run is None:
+            run = self._failed_run("Sandbox process terminated unexpectedly", harness)
+        
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        rss_scale = 1 if sys.platform == "darwin" else 1024
+        peak_memory = None
+        if start_rss is not None:
+            peak_memory = max(0, usage.ru_maxrss - start_rss) * rss_scale
+        run.update({
+            "timed_out": timed_out,
+            "peak_memory_bytes": peak_memory,
+            "cpu_time": usage.ru_utime + usage.ru_stime
+        })
+        return run
+    
+    def _execute_in_subprocess(self, code: CodeType, harness: QuestHarness = None) -> Dict:
+        """Execute code in a forked child with CPU/memory limits, killing it on timeout"""
+        pid, read_fd = self._spawn_child(code, harness, stream=False)
+        
+        # Parent: collect the result until EOF or until the wall-clock deadline passes
+        chunks = []
+        timed_out = False
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    os.kill(pid, signal.SIGKILL)
+                    break
+                ready, _, _ = select.select([read_fd], [], [], remaining)
+                if not ready:
+                    continue
+                data = os.read(read_fd, 65536)
+                if not data:
+                    break
+                chunks.append(data)
+        finally:
+            os.close(read_fd)
+            _, exit_status, usage = os.wait4(pid, 0)
+        
+        run = None
+        start_rss = None
+        try:
+            for line in b"".join(chunks).splitlines():
+                frame = json.loads(line)
+                if frame["type"] == "start":
+                    start_rss = frame["rss"]
+                elif frame["type"] == "run":
+                    run = frame["run"]
+        except ValueError:
+            pass
+        return self._finish_run(run, exit_status, usage, start_rss, timed_out, harness)
+    
+    async def _stream_subprocess(self, code: CodeType, harness: QuestHarness = None) -> AsyncIterator[Dict]:
+        """Like _execute_in_subprocess, but yields the child's frames while it runs
+        
+        The last frame is always {"type": "run", "run": ...}; its run has
+        "streamed" set when the runtime tests were already sent as frames.
+        """
+        pid, read_fd = self._spawn_child(code, harness, stream=True)
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=self.max_frame_bytes)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", buffering=0)
+        )
+        
+        run = None
+        start_rss = None
+        exited = False
+        broken = False
+        timed_out = False
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    line = await asyncio.wait_for(reader.readline(), remaining)
+                    frame = json.loads(line) if line else None
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    break
+                except ValueError as e:
+                    # An over-long or garbled frame: the protocol is broken, stop the child
+                    run = self._failed_run(f"Sandbox error: unreadable frame ({e})", harness)
+                    broken = True
+                    break
+                if frame is None:
+                    exited = True
+                    break
+                if frame["type"] == "start":
+                    start_rss = frame["rss"]
+                elif frame["type"] == "run":
+                    run = frame["run"]
+                else:
+                    yield frame
+        finally:
+            # Also reached when the client disconnects and the generator is closed
+            transport.close()
+            if not exited:
+                os.kill(pid, signal.SIGKILL)
+            _, exit_status, usage = os.wait4(pid, 0)
+        
+        streamed = run is not None and not broken
+        run = self._finish_run(run, exit_status, usage, start_rss, timed_out, harness)
+        run["streamed"] = streamed and not run["timed_out"]
+        yield {"type": "run", "run": run}
+    
+    def _failed_run(self, error: str, harness: QuestHarness = None) -> Dict:
+        """Result of a run whose child died before reporting, with every runtime test failed"""
+        test_results = []
+        if harness is not None:
+            for test in harness.tests:
+                test_results.append({
+                    "description": test.description,
+                    "passed": False,
+                    "points": test.points,
+                    "message": error
+                })
+        return {
+            "output": "",
+            "error": error,
+            "output_truncated": False,
+            "test_results": test_results
+        }
+    
+    def _apply_limits(self):
+        """Apply CPU and address-space limits to the current (child) process"""
+        import resource
+        
+        cpu_seconds = int(math.ceil(self.timeout))
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        
+        # The child inherits the server's address space, so the budget is added on top of it
+        try:
+            with open("/proc/self/statm") as statm:
+                current = int(statm.read().split()[0]) * resource.getpagesize()
+        except (OSError, ValueError):
+            return
+        limit = current + self.max_memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
     
     def _clean_code(self, code: str) -> str:
         """Clean and prepare code for execution"""
+        # Normalize line endings so identical programs hash identically
+        code = code.replace('\r\n', '\n').replace('\r', '\n')
+        
         # Remove any potential dangerous imports or operations
         lines = code.split('\n')
         cleaned_lines = []
@@ -72,44 +659,23 @@ class CodeExecutor:
             # Allow the line (basic filtering)
             cleaned_lines.append(line)
         
-        return '\n'.join(cleaned_lines)
+        # Trailing whitespace at the end of the program never changes its meaning
+        return '\n'.join(cleaned_lines).rstrip()
     
-    def _is_safe_code(self, code: str) -> bool:
-        """Check if code is safe to execute"""
-        dangerous_patterns = [
-            r'import\s+os',
-            r'import\s+sys',
-            r'import\s+subprocess',
-            r'import\s+socket',
-            r'import\s+urllib',
-            r'import\s+requests',
-            r'import\s+shutil',
-            r'import\s+glob',
-            r'from\s+os\s+import',
-            r'from\s+sys\s+import',
-            r'from\s+subprocess\s+import',
-            r'__import__',
-            r'eval\s*\(',
-            r'exec\s*\(',
-            r'open\s*\(',
-            r'file\s*\(',
-            r'input\s*\(',
-            r'raw_input\s*\(',
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, code, re.IGNORECASE):
-                return False
+    def _execute_in_sandbox(self, code: CodeType, harness: QuestHarness = None, frames: FrameWriter = None) -> Dict:
+        """Execute code in a sandboxed environment, then run the quest's runtime tests on its globals
         
-        return True
-    
-    def _execute_in_sandbox(self, code: str) -> Tuple[str, str]:
-        """Execute code in a sandboxed environment"""
+        With frames, output chunks and test results are also streamed as they are produced.
+        """
         try:
+            # Capture output in a buffer owned by this run only
+            output_buffer = OutputBuffer(self.max_output_bytes, frames.stdout if frames else None)
+            
             # Create a restricted environment
             safe_globals = {
+                '__name__': '__main__',
                 '__builtins__': {
-                    'print': print,
+                    'print': make_print(output_buffer),
                     'len': len,
                     'str': str,
                     'int': int,
@@ -144,68 +710,42 @@ class CodeExecutor:
                     'oct': oct,
                     'pow': pow,
                     'divmod': divmod,
+                    '__import__': make_import(ALLOWED_MODULES),
                     'True': True,
                     'False': False,
                     'None': None,
                 }
             }
             
-            # Capture output
-            output_buffer = StringIO()
-            error_buffer = StringIO()
-            
             try:
-                with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
-                    # Execute the code
-                    exec(code, safe_globals)
-                
-                output = output_buffer.getvalue()
-                error = error_buffer.getvalue()
-                
-                return output, error if error else None
-                
+                # Execute the code
+                exec(code, safe_globals)
+                output, error = output_buffer.getvalue(), None
+            except MemoryError:
+                output, error = "", f"Memory limit exceeded ({self.max_memory // (1024 * 1024)}MB)"
             except Exception as e:
-                return "", str(e)
+                output, error = "", str(e)
+            
+            # Runtime tests see whatever the program defined, even if it failed part-way
+            on_result = (lambda result: frames.send({"type": "test", "result": result})) if frames else None
+            test_results = harness.run(safe_globals, output_buffer.getvalue(), on_result) if harness else []
+            
+            return {
+                "output": output,
+                "error": error,
+                "output_truncated": output_buffer.truncated,
+                "test_results": test_results
+            }
                 
         except Exception as e:
-            return "", f"Sandbox error: {str(e)}"
+            return self._failed_run(f"Sandbox error: {str(e)}", harness)
     
-    def _run_tests(self, code: str, quest_id: str) -> List[Dict]:
-        """Run tests for the specific quest"""
-        test_results = []
-        
+    def _run_tests(self, submission: Submission, quest_id: str) -> List[Dict]:
+        """Run the static checks for the quest"""
         try:
-            # Parse the code to check for variables and functions
-            tree = ast.parse(code)
-            
-            # Basic tests based on quest_id
-            if quest_id == "basic-1":
-                test_results = self._test_basic_1(tree, code)
-            elif quest_id == "basic-2":
-                test_results = self._test_basic_2(tree, code)
-            elif quest_id == "basic-3":
-                test_results = self._test_basic_3(tree, code)
-            else:
-                # Generic tests
-                test_results = [
-                    {
-                        "description": "Code syntax check",
-                        "passed": True,
-                        "points": 50
-                    }
-                ]
-            
-        except SyntaxError as e:
-            test_results = [
-                {
-                    "description": "Syntax Error",
-                    "passed": False,
-                    "points": 0,
-                    "message": str(e)
-                }
-            ]
+            return run_static_checks(submission.facts, quest_id)
         except Exception as e:
-            test_results = [
+            return [
                 {
                     "description": "Test execution error",
                     "passed": False,
@@ -213,132 +753,6 @@ class CodeExecutor:
                     "message": str(e)
                 }
             ]
-        
-        return test_results
-    
-    def _test_basic_1(self, tree: ast.AST, code: str) -> List[Dict]:
-        """Test for basic-1 quest (Variables & Data Types)"""
-        results = []
-        
-        # Check for variable assignments
-        variables = {}
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name):
-                        variables[target.id] = type(node.value).__name__
-        
-        # Test for name variable
-        results.append({
-            "description": "Check if name variable is defined",
-            "passed": 'name' in variables,
-            "points": 10
-        })
-        
-        # Test for age variable
-        results.append({
-            "description": "Check if age variable is defined",
-            "passed": 'age' in variables,
-            "points": 10
-        })
-        
-        # Test for height variable
-        results.append({
-            "description": "Check if height variable is defined",
-            "passed": 'height' in variables,
-            "points": 10
-        })
-        
-        # Test for is_student variable
-        results.append({
-            "description": "Check if is_student variable is defined",
-            "passed": 'is_student' in variables,
-            "points": 10
-        })
-        
-        # Test for print statements
-        print_count = 0
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'print':
-                print_count += 1
-        
-        results.append({
-            "description": "Check if variables are printed",
-            "passed": print_count >= 4,
-            "points": 10
-        })
-        
-        return results
-    
-    def _test_basic_2(self, tree: ast.AST, code: str) -> List[Dict]:
-        """Test for basic-2 quest (Control Flow)"""
-        results = []
-        
-        # Check for if statements
-        has_if = False
-        has_for = False
-        has_while = False
-        
-        for node in ast.walk(tree):
-            if isinstance(node, ast.If):
-                has_if = True
-            elif isinstance(node, ast.For):
-                has_for = True
-            elif isinstance(node, ast.While):
-                has_while = True
-        
-        results.append({
-            "description": "Check for if statement",
-            "passed": has_if,
-            "points": 15
-        })
-        
-        results.append({
-            "description": "Check for for loop",
-            "passed": has_for,
-            "points": 15
-        })
-        
-        results.append({
-            "description": "Check for while loop",
-            "passed": has_while,
-            "points": 15
-        })
-        
-        # Check for range function (commonly used in for loops)
-        has_range = False
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'range':
-                has_range = True
-        
-        results.append({
-            "description": "Check for proper loop structure",
-            "passed": has_range,
-            "points": 15
-        })
-        
-        return results
-    
-    def _test_basic_3(self, tree: ast.AST, code: str) -> List[Dict]:
-        """Test for basic-3 quest (Functions)"""
-        results = []
-        
-        # Check for function definitions
-        functions = []
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                functions.append(node.name)
-        
-        expected_functions = ['greet_user', 'calculate_area', 'is_even', 'find_max']
-        
-        for func_name in expected_functions:
-            results.append({
-                "description": f"Check for {func_name} function",
-                "passed": func_name in functions,
-                "points": 20
-            })
-        
-        return results
 
 # Initialize the code executor
 code_executor = CodeExecutor()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import _string
+import ast
+from string import Formatter
+from typing import Dict, List
+
+# Modules user code may import. Only modules that expose no other modules or
+# writable state are listed, so an import can't be used to reach os or sys.
+ALLOWED_MODULES = {"math", "cmath", "itertools", "heapq", "bisect"}
+
+# Builtins and names that must never be referenced
+BANNED_NAMES = {
+    "eval", "exec", "compile", "open", "file", "input", "raw_input",
+    "__import__", "globals", "locals", "vars", "breakpoint", "exit", "quit",
+    "__builtins__", "__loader__", "__spec__",
+}
+
+# Frame, code and traceback attributes: walking from a generator, coroutine or
+# traceback to a frame reaches the globals of the code that runs the sandbox
+BANNED_ATTRIBUTES = {
+    "gi_frame", "gi_code", "gi_yieldfrom", "cr_frame", "cr_code", "cr_await",
+    "ag_frame", "ag_code", "ag_await", "f_back", "f_globals", "f_locals",
+    "f_builtins", "f_code", "tb_frame", "tb_next", "func_globals", "func_code",
+}
+
+# str methods that read attributes named inside the template, e.g. "{0.gi_frame}"
+FORMAT_METHODS = {"format", "format_map"}
+
+# Dunder attributes that are part of normal class definitions and are safe to touch
+SAFE_DUNDER_ATTRIBUTES = {
+    "__init__", "__str__", "__repr__", "__name__", "__doc__",
+    "__len__", "__iter__", "__next__", "__contains__", "__getitem__", "__setitem__",
+    "__eq__", "__ne__", "__lt__", "__le__", "__gt__", "__ge__", "__hash__",
+    "__add__", "__sub__", "__mul__", "__truediv__", "__bool__",
+}
+
+# Dunder names that may appear as plain names, e.g. `if __name__ == "__main__":`
+SAFE_DUNDER_NAMES = {"__name__"}
+
+def _is_dunder(name: str) -> bool:
+    return name.startswith("__") and name.endswith("__") and len(name) > 4
+
+def _is_banned_attribute(name: str) -> bool:
+    if _is_dunder(name):
+        return name not in SAFE_DUNDER_ATTRIBUTES
+    return name in BANNED_ATTRIBUTES
+
+def _banned_format_fields(template: str) -> List[str]:
+    """Attribute and index names in a format template's fields that would be banned in code"""
+    banned = []
+    try:
+        for _, field_name, format_spec, _ in Formatter().parse(template):
+            if field_name is None:
+                continue
+            _, rest = _string.formatter_field_name_split(field_name)
+            for _, key in rest:
+                if isinstance(key, str) and _is_banned_attribute(key):
+                    banned.append(key)
+            # Nested fields, e.g. "{0:{1.attr}}"
+            if format_spec and "{" in format_spec:
+                banned.extend(_banned_format_fields(format_spec))
+    except ValueError:
+        # Malformed template, format() raises at runtime without reading anything
+        pass
+    return banned
+
+class PolicyChecker(ast.NodeVisitor):
+    """Single-pass visitor that reports every policy violation with its line number"""
+
+    def __init__(self):
+        self.violations: List[Dict] = []
+
+    def _report(self, node: ast.AST, message: str):
+        self.violations.append({"line": getattr(node, "lineno", 0), "message": message})
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self._check_module(node, alias.name)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.level:
+            self._report(node, "relative imports are not allowed")
+        else:
+            self._check_module(node, node.module or "")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        if node.id in BANNED_NAMES:
+            self._report(node, f"use of '{node.id}' is not allowed")
+        elif _is_dunder(node.id) and node.id not in SAFE_DUNDER_NAMES:
+            self._report(node, f"access to '{node.id}' is not allowed")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        if _is_banned_attribute(node.attr):
+            self._report(node, f"access to attribute '{node.attr}' is not allowed")
+        elif node.attr in FORMAT_METHODS:
+            self._check_format(node)
+        self.generic_visit(node)
+
+    def visit_MatchClass(self, node: ast.MatchClass):
+        # case T(attr=pattern) reads T.attr just like an attribute access
+        for attr in node.kwd_attrs:
+            if _is_banned_attribute(attr):
+                self._report(node, f"access to attribute '{attr}' is not allowed")
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        # getattr/setattr with a banned or computed name would bypass the attribute check
+        if isinstance(node.func, ast.Name) and node.func.id in ("getattr", "setattr", "hasattr", "delattr"):
+            if len(node.args) >= 2:
+                attr = node.args[1]
+                if isinstance(attr, ast.Constant) and isinstance(attr.value, str):
+                    if _is_banned_attribute(attr.value):
+                        self._report(node, f"access to attribute '{attr.value}' is not allowed")
+                    elif attr.value in FORMAT_METHODS and node.func.id == "getattr":
+                        self._report(node, f"{attr.value}() is only allowed on a string literal")
+                elif node.func.id in ("getattr", "setattr"):
+                    self._report(node, f"{node.func.id}() needs a literal attribute name")
+        self.generic_visit(node)
+
+    def _check_format(self, node: ast.Attribute):
+        """Format templates can walk attributes too, so they must be literals with allowed fields"""
+        template = node.value
+        if not (isinstance(template, ast.Constant) and isinstance(template.value, str)):
+            self._report(node, f"{node.attr}() is only allowed on a string literal")
+            return
+        for attr in _banned_format_fields(template.value):
+            self._report(node, f"access to attribute '{attr}' is not allowed")
+
+    def _check_module(self, node: ast.AST, module: str):
+        if module.split(".")[0] not in ALLOWED_MODULES:
+            self._report(node, f"import of '{module}' is not allowed")
+
+def check_policy(tree: ast.AST) -> List[Dict]:
+    """Return the policy violations of a parsed submission, in source order"""
+    checker = PolicyChecker()
+    checker.visit(tree)
+    return sorted(checker.violations, key=lambda violation: violation["line"])
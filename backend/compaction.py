@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+from database import blob_store, db
+
+async def compact_code_executions(batch_size: int = 500) -> Dict:
+    """Move inline code and output of stored executions into the blob store
+
+    Executions written before content-addressed storage carry their code and
+    output strings; each batch stores those bodies once per hash, then
+    replaces them with code_hash/output_hash in a single bulk write. Safe to
+    interrupt and re-run: only documents still holding inline code are read.
+    """
+    started = time.monotonic()
+    stats = {"compacted": 0, "bytes_inlined": 0}
+    query = {"code": {"$exists": True}}
+    projection = {"_id": 1, "code": 1, "output": 1}
+
+    async def compact(batch: List[Dict]):
+        keys = await blob_store.put_many(
+            body for execution in batch for body in (execution["code"], execution.get("output") or "")
+        )
+        updates = []
+        for i, execution in enumerate(batch):
+            updates.append(UpdateOne(
+                {"_id": execution["_id"]},
+                {"$set": {"code_hash": keys[2 * i], "output_hash": keys[2 * i + 1]},
+                 "$unset": {"code": "", "output": ""}}
+            ))
+            stats["bytes_inlined"] += len(execution["code"].encode()) + len((execution.get("output") or "").encode())
+        result = await db.code_executions.bulk_write(updates, ordered=False)
+        stats["compacted"] += result.modified_count
+        print(f"{stats['compacted']} executions compacted, {time.monotonic() - started:.1f}s elapsed", flush=True)
+
+    batch = []
+    async for execution in db.code_executions.find(query, projection).batch_size(batch_size):
+        batch.append(execution)
+        if len(batch) >= batch_size:
+            await compact(batch)
+            batch = []
+    if batch:
+        await compact(batch)
+
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Move inline code and output of stored executions into the blob store")
+    parser.add_argument("--batch-size", type=int, default=500, help="executions rewritten per bulk write")
+    args = parser.parse_args()
+
+    stats = asyncio.run(compact_code_executions(args.batch_size))
+    print(f"Done: {stats['compacted']} executions compacted, {stats['bytes_inlined']} bytes of inline text moved. "
+          "Run the compact command on code_executions to return the freed space to the OS.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import os
+import re
+from typing import Dict, Iterable, List
+
+from ai_hints import ai_hint_generator
+from cache import TTLCache
+from database import get_concept_explanation, get_concept_explanations, save_concept_explanation
+
+# Concepts the quests talk about; the warm-up job precomputes these
+DEFAULT_CONCEPTS = [
+    "variables", "data types", "strings", "numbers", "booleans", "operators",
+    "if statements", "loops", "for loops", "while loops", "range",
+    "functions", "parameters", "return values", "scope",
+    "list", "tuple", "dict", "set", "comprehensions",
+    "exceptions", "classes", "modules", "recursion",
+]
+
+# Longest concept name the API accepts; longer names are rejected before any lookup
+MAX_CONCEPT_LENGTH = 64
+
+def normalize_concept(concept: str) -> str:
+    """Canonical form of a concept name: lowercase, single spaces"""
+    return re.sub(r"[\s_-]+", " ", concept).strip().lower()
+
+class ConceptStore:
+    """Concept explanations served from memory, persisted in Mongo
+
+    Explanations are precomputed by the warm-up job and loaded at startup.
+    A miss asks the model once: concurrent requests for the same concept
+    wait on the same call instead of starting their own. Only concepts of
+    the built-in vocabulary are persisted; explanations of anything else a
+    client asks for live in a bounded cache.
+    """
+
+    def __init__(self, vocabulary: Iterable[str] = DEFAULT_CONCEPTS, other_size: int = None):
+        self.vocabulary = {normalize_concept(concept) for concept in vocabulary}
+        self._explanations: Dict[str, str] = {}
+        self._other = TTLCache(maxsize=other_size or int(os.getenv("CONCEPT_CACHE_SIZE", 1000)), ttl=24 * 3600)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def load(self):
+        self._explanations = await get_concept_explanations()
+
+    def __len__(self) -> int:
+        return len(self._explanations)
+
+    async def get(self, concept: str) -> str:
+        key = normalize_concept(concept)
+        explanation = self._explanations.get(key)
+        if explanation is None:
+            explanation = self._other.get(key)
+        if explanation is not None:
+            return explanation
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, so one client disconnecting doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str) -> str:
+        # Another instance may have generated it since startup
+        explanation = await get_concept_explanation(key)
+        if explanation is not None:
+            self._explanations[key] = explanation
+            return explanation
+
+        explanation = await ai_hint_generator.request_explanation(key)
+        if explanation is None:
+            # Not stored, so the next request tries again
+            return ai_hint_generator.fallback_explanation(key)
+        if key in self.vocabulary:
+            await save_concept_explanation(key, explanation)
+            self._explanations[key] = explanation
+        else:
+            self._other.set(key, explanation)
+        return explanation
+
+    async def warm(self, concepts: Iterable[str], concurrency: int = 4, force: bool = False) -> List[str]:
+        """Generate and store explanations in bulk; returns the concepts that failed"""
+        keys = {normalize_concept(concept) for concept in concepts}
+        if not force:
+            stored = await get_concept_explanations()
+            keys -= stored.keys()
+
+        semaphore = asyncio.Semaphore(concurrency)
+        failed = []
+
+        async def warm_one(key: str):
+            async with semaphore:
+                explanation = await ai_hint_generator.request_explanation(key)
+            if explanation is None:
+                failed.append(key)
+                return
+            await save_concept_explanation(key, explanation)
+            self._explanations[key] = explanation
+            print(f"Stored explanation for '{key}'", flush=True)
+
+        await asyncio.gather(*(warm_one(key) for key in sorted(keys)))
+        return failed
+
+# Initialize the concept store
+concept_store = ConceptStore()
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute concept explanations into the concepts collection")
+    parser.add_argument("concepts", nargs="*", help="concepts to generate (defaults to the built-in vocabulary)")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent model calls")
+    parser.add_argument("--force", action="store_true", help="regenerate explanations that are already stored")
+    args = parser.parse_args()
+
+    if not ai_hint_generator.enabled:
+        raise SystemExit("GEMINI_API_KEY is not set")
+    failed = asyncio.run(concept_store.warm(args.concepts or DEFAULT_CONCEPTS, args.concurrency, args.force))
+    if failed:
+        raise SystemExit(f"Failed to generate: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import os
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
 import uuid
 
+from blob_store import BlobStore
+from write_behind import WriteBehindBuffer
+
 # MongoDB connection
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/codequest")
 client = AsyncIOMotorClient(MONGO_URL)
@@ -15,6 +20,46 @@ users_collection = db.users
 quests_collection = db.quests
 progress_collection = db.progress
 leaderboard_collection = db.leaderboard
+leaderboard_buckets_collection = db.leaderboard_buckets
+meta_collection = db.meta
+concepts_collection = db.concepts
+
+# Code and output bodies of executions, stored once per content hash
+blob_store = BlobStore(db.blobs)
+
+class ExecutionWriter(WriteBehindBuffer):
+    """Stores the code and output of a batch in the blob store, then the executions referencing them"""
+
+    async def _write(self, documents: List[Dict]):
+        # Documents of a retried batch already reference their bodies
+        unstored = [document for document in documents if "code" in document]
+        keys = await blob_store.put_many(
+            body for document in unstored for body in (document["code"], document["output"])
+        )
+        for i, document in enumerate(unstored):
+            document["code_hash"] = keys[2 * i]
+            document["output_hash"] = keys[2 * i + 1]
+            del document["code"], document["output"]
+        await self.collection.insert_many(documents, ordered=False)
+
+# Executions and hints are history: written in batches, off the request path
+code_executions_writer = ExecutionWriter(db.code_executions)
+hints_writer = WriteBehindBuffer(db.hints)
+WRITE_BEHIND_BUFFERS = {"code_executions": code_executions_writer, "hints": hints_writer}
+
+# XP needed for each level
+XP_PER_LEVEL = 100
+
+# Most achievements a progress document holds, so clients can't grow it without bound
+MAX_ACHIEVEMENTS = 100
+
+# Leaderboard time filters -> how long a bucket of that period is kept around
+LEADERBOARD_PERIODS = {
+    "daily": timedelta(days=8),
+    "weekly": timedelta(weeks=5),
+    "monthly": timedelta(days=400),
+    "all-time": None,
+}
 
 # Pydantic models
 class User(BaseModel):
@@ -83,7 +128,33 @@ async def init_db():
         await users_collection.create_index("uid", unique=True)
         await users_collection.create_index("email", unique=True)
         await progress_collection.create_index("user_id", unique=True)
+        # Progress is read and written by Firebase uid, in a single query
+        await progress_collection.create_index(
+            "uid", unique=True, partialFilterExpression={"uid": {"$type": "string"}}
+        )
         await quests_collection.create_index("id", unique=True)
+        await leaderboard_collection.create_index("user_id", unique=True)
+        await db.hints.create_index([("cache_key", ASCENDING), ("created_at", DESCENDING)])
+        await concepts_collection.create_index("concept", unique=True)
+        await leaderboard_collection.create_index([("xp", DESCENDING), ("user_id", ASCENDING)])
+        
+        await leaderboard_buckets_collection.create_index(
+            [("period", ASCENDING), ("category", ASCENDING), ("user_id", ASCENDING)], unique=True
+        )
+        await leaderboard_buckets_collection.create_index(
+            [("period", ASCENDING), ("category", ASCENDING), ("xp", DESCENDING), ("user_id", ASCENDING)]
+        )
+        await leaderboard_buckets_collection.create_index("expires_at", expireAfterSeconds=0)
+        
+        # Progress written before it carried the uid
+        if await progress_collection.find_one({"uid": {"$exists": False}}, {"_id": 1}):
+            await backfill_progress_uids()
+        
+        # Materialize the leaderboards once for data written before they existed
+        if await leaderboard_collection.estimated_document_count() == 0:
+            await rebuild_leaderboard()
+        if await leaderboard_buckets_collection.estimated_document_count() == 0:
+            await rebuild_leaderboard_buckets()
         
         # Insert default quests if not exist
         await create_default_quests()
@@ -137,10 +208,14 @@ print(f"In 5 years, you will be {age + 5} years old")
 ''',
             "expected_output": "Variables should be printed with descriptive messages",
             "test_cases": [
-                {"description": "Check if name variable is defined", "test": "name variable should be a string", "points": 10},
-                {"description": "Check if age variable is defined", "test": "age variable should be an integer", "points": 10},
-                {"description": "Check if height variable is defined", "test": "height variable should be a float", "points": 10},
-                {"description": "Check if is_student variable is defined", "test": "is_student variable should be a boolean", "points": 10},
+                {"description": "Check that name is a string", "test": "name variable should be a string", "points": 10,
+                 "call": "isinstance(name, str)", "expected": True},
+                {"description": "Check that age is an integer", "test": "age variable should be an integer", "points": 10,
+                 "call": "isinstance(age, int) and not isinstance(age, bool)", "expected": True},
+                {"description": "Check that height is a float", "test": "height variable should be a float", "points": 10,
+                 "call": "isinstance(height, float)", "expected": True},
+                {"description": "Check that is_student is a boolean", "test": "is_student variable should be a boolean", "points": 10,
+                 "call": "isinstance(is_student, bool)", "expected": True},
                 {"description": "Check if all variables are printed", "test": "All variables should be printed with descriptive messages", "points": 10}
             ],
             "created_at": datetime.utcnow(),
@@ -201,10 +276,14 @@ else:
 ''',
             "expected_output": "Program should demonstrate if statements and loops",
             "test_cases": [
-                {"description": "Check conditional logic", "test": "Number classification should work correctly", "points": 15},
-                {"description": "Check for loop", "test": "For loop should print numbers 1 to 10", "points": 15},
-                {"description": "Check while loop", "test": "While loop should calculate sum correctly", "points": 15},
-                {"description": "Check guessing game logic", "test": "Guessing game should provide correct feedback", "points": 15}
+                {"description": "Check conditional logic", "test": "Number classification should work correctly", "points": 15,
+                 "expected_stdout": r"-?\d+ is (positive|negative|zero)"},
+                {"description": "Check for loop", "test": "For loop should print numbers 1 to 10", "points": 15,
+                 "expected_stdout": r"(?m)^1\n2\n3\n4\n5\n6\n7\n8\n9\n10$"},
+                {"description": "Check while loop", "test": "While loop should calculate sum correctly", "points": 15,
+                 "call": "sum_result", "expected": 15},
+                {"description": "Check guessing game logic", "test": "Guessing game should provide correct feedback", "points": 15,
+                 "expected_stdout": r"Congratulations! You guessed it!|Too low!|Too high!"}
             ],
             "created_at": datetime.utcnow(),
             "is_active": True
@@ -251,10 +330,14 @@ print(f"Max of 10 and 7: {find_max(10, 7)}")
 ''',
             "expected_output": "Functions should work correctly and return expected values",
             "test_cases": [
-                {"description": "Check greet_user function", "test": "Function should return proper greeting", "points": 20},
-                {"description": "Check calculate_area function", "test": "Function should calculate area correctly", "points": 20},
-                {"description": "Check is_even function", "test": "Function should identify even/odd numbers", "points": 20},
-                {"description": "Check find_max function", "test": "Function should return maximum value", "points": 20}
+                {"description": "Check greet_user function", "test": "Function should return proper greeting", "points": 20,
+                 "call": "'Ada' in greet_user('Ada')", "expected": True},
+                {"description": "Check calculate_area function", "test": "Function should calculate area correctly", "points": 20,
+                 "call": "[calculate_area(5, 3), calculate_area(2, 2.5)]", "expected": [15, 5.0]},
+                {"description": "Check is_even function", "test": "Function should identify even/odd numbers", "points": 20,
+                 "call": "[is_even(0), is_even(7), is_even(8)]", "expected": [True, False, True]},
+                {"description": "Check find_max function", "test": "Function should return maximum value", "points": 20,
+                 "call": "[find_max(10, 7), find_max(-2, 3)]", "expected": [10, 3]}
             ],
             "created_at": datetime.utcnow(),
             "is_active": True
@@ -265,6 +348,23 @@ print(f"Max of 10 and 7: {find_max(10, 7)}")
         existing = await quests_collection.find_one({"id": quest["id"]})
         if not existing:
             await quests_collection.insert_one(quest)
+            await bump_quests_version()
+        elif existing.get("test_cases") != quest["test_cases"]:
+            # Keep the executable test cases of built-in quests in sync with the code
+            await quests_collection.update_one(
+                {"id": quest["id"]},
+                {"$set": {"test_cases": quest["test_cases"]}}
+            )
+            await bump_quests_version()
+
+async def bump_quests_version():
+    """Mark the quest catalog as changed; call after every write to quests"""
+    await meta_collection.update_one({"_id": "quests"}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_quests_version() -> int:
+    """Current quest catalog version stamp"""
+    stamp = await meta_collection.find_one({"_id": "quests"})
+    return stamp["version"] if stamp else 0
 
 # User management functions
 async def create_user(uid: str, email: str, username: str, display_name: str = None):
@@ -287,6 +387,7 @@ async def create_user(uid: str, email: str, username: str, display_name: str = N
     progress = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
+        "uid": uid,
         "level": 1,
         "xp": 0,
         "completed_quests": [],
@@ -299,6 +400,11 @@ async def create_user(uid: str, email: str, username: str, display_name: str = N
     }
     
     await progress_collection.insert_one(progress)
+    await leaderboard_collection.update_one(
+        {"user_id": user_id},
+        {"$set": _leaderboard_entry(user, progress)},
+        upsert=True
+    )
     return user
 
 async def get_user_by_uid(uid: str):
@@ -309,13 +415,307 @@ async def get_user_progress(user_id: str):
     """Get user progress"""
     return await progress_collection.find_one({"user_id": user_id})
 
-async def update_user_progress(user_id: str, progress_data: dict):
-    """Update user progress"""
-    progress_data["updated_at"] = datetime.utcnow()
-    await progress_collection.update_one(
-        {"user_id": user_id},
-        {"$set": progress_data}
+async def get_progress_by_uid(uid: str):
+    """Get user progress by Firebase UID"""
+    return await progress_collection.find_one({"uid": uid})
+
+def level_for_xp(xp: int) -> int:
+    """Players level up every XP_PER_LEVEL xp"""
+    return xp // XP_PER_LEVEL + 1
+
+def _progress_event_update(uid: str, event: dict, now: datetime, client_id: str = None) -> UpdateOne:
+    """Small, constant-size update applying one progress event
+    
+    Each update only matches while the event has not been applied yet, so
+    replays and concurrent tabs can't award the same quest twice. Events
+    with a client sequence number also apply at most once per client: the
+    highest applied number is kept in event_seqs.<client_id>.
+    """
+    query, update = _progress_event_operators(uid, event, now)
+    seq = event.get("seq")
+    if client_id and seq is not None:
+        query[f"event_seqs.{client_id}"] = {"$not": {"$gte": seq}}
+        update["$max"] = {f"event_seqs.{client_id}": seq}
+    return UpdateOne(query, update)
+
+def _progress_event_operators(uid: str, event: dict, now: datetime) -> Tuple[dict, dict]:
+    touched = {"last_activity": now, "updated_at": now}
+    if event["type"] == "quest_completed":
+        return (
+            {"uid": uid, "completed_quests": {"$ne": event["quest_id"]}},
+            {
+                "$addToSet": {"completed_quests": event["quest_id"]},
+                "$inc": {"xp": event["xp"]},
+                # Leaderboard buckets are credited from here, see apply_progress_events
+                "$push": {"uncredited": {"quest_id": event["quest_id"], "xp": event["xp"], "category": event["category"]}},
+                "$set": touched
+            }
+        )
+    if event["type"] == "achievement_earned":
+        return (
+            {
+                "uid": uid,
+                "achievements": {"$ne": event["achievement"]},
+                # Full once the last allowed slot is taken
+                f"achievements.{MAX_ACHIEVEMENTS - 1}": {"$exists": False}
+            },
+            {"$addToSet": {"achievements": event["achievement"]}, "$set": touched}
+        )
+    if event["type"] == "quest_started":
+        return {"uid": uid}, {"$set": dict(touched, current_quest=event["quest_id"])}
+    raise ValueError(f"Unknown progress event type: {event['type']}")
+
+async def apply_progress_events(uid: str, events: List[dict], client_id: str = None) -> Optional[dict]:
+    """Apply progress events on the server and return the resulting progress
+    
+    Events are applied in order with one bulk write. A second, atomic update
+    then derives the level from xp and claims the quest credits the events
+    queued, so each completed quest reaches the leaderboard buckets exactly once.
+    With a client_id, it also acknowledges the batch's sequence numbers, so
+    events that were skipped as already applied aren't sent again.
+    """
+    now = datetime.utcnow()
+    updates = [_progress_event_update(uid, event, now, client_id) for event in events]
+    if updates:
+        await progress_collection.bulk_write(updates, ordered=True)
+    
+    derived_level = {"$add": [{"$floor": {"$divide": ["$xp", XP_PER_LEVEL]}}, 1]}
+    claim = {"level": {"$max": ["$level", derived_level]}, "uncredited": []}
+    seqs = [event["seq"] for event in events if event.get("seq") is not None]
+    if client_id and seqs:
+        seq_field = f"event_seqs.{client_id}"
+        claim[seq_field] = {"$max": [f"${seq_field}", max(seqs)]}
+    state = await progress_collection.find_one_and_update(
+        {"uid": uid},
+        [{"$set": claim}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if not state:
+        return None
+    
+    uncredited = state.pop("uncredited", None) or []
+    progress = {**state, "level": max(state["level"], level_for_xp(state["xp"]))}
+    if client_id and seqs:
+        event_seqs = progress.setdefault("event_seqs", {})
+        event_seqs[client_id] = max(event_seqs.get(client_id, 0), max(seqs))
+    await sync_leaderboard_entry(progress)
+    if uncredited:
+        credits = {"all": [0, 0]}
+        for quest in uncredited:
+            for category in ("all", quest["category"]):
+                category_credit = credits.setdefault(category, [0, 0])
+                category_credit[0] += quest["xp"]
+                category_credit[1] += 1
+        await _credit_buckets(progress, credits)
+    return progress
+
+async def backfill_progress_uids():
+    """Copy each user's Firebase uid onto their progress document, server-side"""
+    pipeline = [
+        {
+            "$match": {"uid": {"$exists": False}}
+        },
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "id",
+                "as": "user"
+            }
+        },
+        {
+            "$unwind": "$user"
+        },
+        {
+            "$project": {"_id": 1, "uid": "$user.uid"}
+        },
+        {
+            "$merge": {
+                "into": "progress",
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }
+        }
+    ]
+    
+    async for _ in progress_collection.aggregate(pipeline):
+        pass
+
+# Leaderboard maintenance
+def _leaderboard_entry(user: Optional[dict], progress: dict) -> dict:
+    """Denormalized leaderboard document for one user"""
+    entry = {
+        "user_id": progress["user_id"],
+        "level": progress["level"],
+        "xp": progress["xp"],
+        "completed_quests": len(progress["completed_quests"]),
+        "achievements": len(progress["achievements"]),
+        "updated_at": datetime.utcnow()
+    }
+    if user:
+        entry["username"] = user["username"]
+        entry["display_name"] = user.get("display_name") or user["username"]
+    return entry
+
+async def sync_leaderboard_entry(progress: dict):
+    """Copy a user's progress into their leaderboard entry"""
+    result = await leaderboard_collection.update_one(
+        {"user_id": progress["user_id"]},
+        {"$set": _leaderboard_entry(None, progress)},
+        upsert=True
     )
+    if result.upserted_id is not None:
+        # New entry for a user created before the leaderboard was materialized
+        user = await users_collection.find_one({"id": progress["user_id"]})
+        if user:
+            await leaderboard_collection.update_one(
+                {"user_id": progress["user_id"]},
+                {"$set": {"username": user["username"], "display_name": user.get("display_name") or user["username"]}}
+            )
+
+def _period_keys(when: datetime) -> Dict[str, str]:
+    """Bucket key of every leaderboard period containing the given time"""
+    iso_year, iso_week, _ = when.isocalendar()
+    return {
+        "daily": f"daily:{when:%Y-%m-%d}",
+        "weekly": f"weekly:{iso_year}-W{iso_week:02d}",
+        "monthly": f"monthly:{when:%Y-%m}",
+        "all-time": "all-time",
+    }
+
+def _bucket_updates(user_id: str, when: datetime, credits: Dict[str, List[int]], names: dict) -> List[UpdateOne]:
+    """Upserts adding xp and quest counts per category to every period bucket of a user"""
+    updates = []
+    for period, key in _period_keys(when).items():
+        retention = LEADERBOARD_PERIODS[period]
+        for category, (xp, quests) in credits.items():
+            if period == "all-time" and category == "all":
+                continue  # served by the materialized leaderboard itself
+            update = {
+                "$inc": {"xp": xp, "completed_quests": quests},
+                "$set": dict(names, updated_at=datetime.utcnow())
+            }
+            if retention is not None:
+                update["$setOnInsert"] = {"expires_at": when + retention}
+            updates.append(UpdateOne(
+                {"period": key, "category": category, "user_id": user_id},
+                update,
+                upsert=True
+            ))
+    return updates
+
+async def _credit_buckets(progress: dict, credits: Dict[str, List[int]]):
+    """Add [xp, quests] per category to a user's period buckets"""
+    entry = await leaderboard_collection.find_one({"user_id": progress["user_id"]}) or {}
+    names = {
+        "username": entry.get("username"),
+        "display_name": entry.get("display_name"),
+        "level": progress.get("level", 1),
+        "achievements": len(progress.get("achievements", []))
+    }
+    updates = _bucket_updates(progress["user_id"], datetime.utcnow(), credits, names)
+    await leaderboard_buckets_collection.bulk_write(updates, ordered=False)
+
+async def rebuild_leaderboard_buckets():
+    """Recompute the time and category buckets from successful code executions
+    
+    The first successful execution of a quest counts as its completion, credited
+    with the quest's xp reward at the time it happened.
+    """
+    pipeline = [
+        {"$match": {"success": True}},
+        {
+            "$group": {
+                "_id": {"uid": "$user_id", "quest_id": "$quest_id"},
+                "completed_at": {"$min": "$created_at"}
+            }
+        },
+        {
+            "$lookup": {
+                "from": "quests",
+                "localField": "_id.quest_id",
+                "foreignField": "id",
+                "as": "quest"
+            }
+        },
+        {"$unwind": "$quest"},
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "_id.uid",
+                "foreignField": "uid",
+                "as": "user"
+            }
+        },
+        {"$unwind": "$user"},
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$user.id",
+                "username": "$user.username",
+                "display_name": {"$ifNull": ["$user.display_name", "$user.username"]},
+                "category": "$quest.category",
+                "xp_reward": "$quest.xp_reward",
+                "completed_at": 1
+            }
+        }
+    ]
+    
+    await leaderboard_buckets_collection.delete_many({})
+    updates = []
+    async for completion in db.code_executions.aggregate(pipeline, allowDiskUse=True):
+        names = {"username": completion["username"], "display_name": completion["display_name"]}
+        credits = {
+            "all": [completion["xp_reward"], 1],
+            completion["category"]: [completion["xp_reward"], 1]
+        }
+        updates.extend(_bucket_updates(completion["user_id"], completion["completed_at"], credits, names))
+        if len(updates) >= 1000:
+            await leaderboard_buckets_collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await leaderboard_buckets_collection.bulk_write(updates, ordered=False)
+
+async def rebuild_leaderboard():
+    """Recompute every leaderboard entry from progress and users in one server-side pass"""
+    pipeline = [
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "id",
+                "as": "user"
+            }
+        },
+        {
+            "$unwind": "$user"
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": 1,
+                "username": "$user.username",
+                "display_name": {"$ifNull": ["$user.display_name", "$user.username"]},
+                "level": 1,
+                "xp": 1,
+                "completed_quests": {"$size": "$completed_quests"},
+                "achievements": {"$size": "$achievements"},
+                "updated_at": "$$NOW"
+            }
+        },
+        {
+            "$merge": {
+                "into": "leaderboard",
+                "on": "user_id",
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]
+    
+    async for _ in progress_collection.aggregate(pipeline):
+        pass
 
 # Quest management functions
 async def get_all_quests():
@@ -336,7 +736,7 @@ async def get_quest_by_id(quest_id: str):
 
 # Code execution functions
 async def save_code_execution(user_id: str, quest_id: str, code: str, output: str, success: bool, execution_time: float, test_results: List[Dict]):
-    """Save code execution result"""
+    """Save code execution result; code and output are stored in the blob store and referenced by hash"""
     execution = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
@@ -349,10 +749,21 @@ async def save_code_execution(user_id: str, quest_id: str, code: str, output: st
         "created_at": datetime.utcnow()
     }
     
-    await db.code_executions.insert_one(execution)
+    await code_executions_writer.insert(execution)
+
+async def get_execution_bodies(executions: List[Dict]) -> List[Dict]:
+    """Fill in code and output of executions that reference them by hash"""
+    keys = [execution[field] for execution in executions for field in ("code_hash", "output_hash") if execution.get(field)]
+    bodies = await blob_store.get_many(keys) if keys else {}
+    for execution in executions:
+        if "code_hash" in execution:
+            execution["code"] = bodies.get(execution["code_hash"])
+        if "output_hash" in execution:
+            execution["output"] = bodies.get(execution["output_hash"])
+    return executions
 
 # Hint functions
-async def save_hint(user_id: str, quest_id: str, hint_text: str, context: str):
+async def save_hint(user_id: str, quest_id: str, hint_text: str, context: str, cache_key: str = None):
     """Save hint request"""
     hint = {
         "id": str(uuid.uuid4()),
@@ -360,48 +771,132 @@ async def save_hint(user_id: str, quest_id: str, hint_text: str, context: str):
         "quest_id": quest_id,
         "hint_text": hint_text,
         "context": context,
+        "cache_key": cache_key,
         "created_at": datetime.utcnow()
     }
     
-    await db.hints.insert_one(hint)
+    await hints_writer.insert(hint)
+
+async def find_cached_hint(cache_key: str, max_age_seconds: float) -> Optional[str]:
+    """Most recent stored hint for a cache key, if it is younger than max_age_seconds"""
+    hint = await db.hints.find_one(
+        {"cache_key": cache_key, "created_at": {"$gte": datetime.utcnow() - timedelta(seconds=max_age_seconds)}},
+        {"hint_text": 1},
+        sort=[("created_at", DESCENDING)]
+    )
+    return hint["hint_text"] if hint else None
+
+# Concept explanation functions
+async def get_concept_explanations() -> Dict[str, str]:
+    """All stored concept explanations, by concept"""
+    explanations = {}
+    async for doc in concepts_collection.find({}, {"_id": 0, "concept": 1, "explanation": 1}):
+        explanations[doc["concept"]] = doc["explanation"]
+    return explanations
+
+async def get_concept_explanation(concept: str) -> Optional[str]:
+    doc = await concepts_collection.find_one({"concept": concept}, {"explanation": 1})
+    return doc["explanation"] if doc else None
+
+async def save_concept_explanation(concept: str, explanation: str):
+    """Store or replace the explanation of a concept"""
+    await concepts_collection.update_one(
+        {"concept": concept},
+        {"$set": {"explanation": explanation, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
 
 # Leaderboard functions
-async def get_leaderboard(time_filter: str = "all-time", category_filter: str = "all"):
-    """Get leaderboard data"""
-    # For now, return mock data based on user progress
-    # In production, this would aggregate data based on filters
+def _leaderboard_source(time_filter: str, category_filter: str):
+    """Collection and base filter holding one leaderboard, both sorted by (xp desc, user_id asc)"""
+    if time_filter not in LEADERBOARD_PERIODS:
+        time_filter = "all-time"
+    if time_filter == "all-time" and category_filter == "all":
+        # The materialized leaderboard
+        return leaderboard_collection, {}
+    # Other combinations are pre-aggregated buckets
+    period = _period_keys(datetime.utcnow())[time_filter]
+    return leaderboard_buckets_collection, {"period": period, "category": category_filter}
+
+def _public_entry(entry: dict, rank: int) -> dict:
+    return {
+        "id": entry["user_id"],
+        "rank": rank,
+        "username": entry.get("username"),
+        "display_name": entry.get("display_name"),
+        "level": entry.get("level", 1),
+        "xp": entry["xp"],
+        "completed_quests": entry["completed_quests"],
+        "achievements": entry.get("achievements", 0)
+    }
+
+def encode_leaderboard_cursor(xp: int, user_id: str) -> str:
+    """Opaque position in the leaderboard order, handed out for ?after="""
+    return base64.urlsafe_b64encode(f"{xp}:{user_id}".encode()).decode().rstrip("=")
+
+def decode_leaderboard_cursor(cursor: str) -> Tuple[int, str]:
+    """Inverse of encode_leaderboard_cursor; raises ValueError for malformed cursors"""
+    try:
+        xp, user_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":", 1)
+        return int(xp), user_id
+    except ValueError as e:  # bad base64, bad UTF-8, missing separator or non-numeric xp
+        raise ValueError("Invalid leaderboard cursor") from e
+
+async def _count_ahead(collection, base: dict, xp: int, user_id: str) -> int:
+    """Number of entries ranked before (xp, user_id)
     
-    pipeline = [
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "id",
-                "as": "user"
-            }
-        },
-        {
-            "$unwind": "$user"
-        },
-        {
-            "$sort": {"xp": -1}
-        },
-        {
-            "$limit": 100
-        }
-    ]
+    Two range counts on the (xp desc, user_id asc) index: strictly more xp,
+    and equal xp with a smaller user_id.
+    """
+    higher = await collection.count_documents({**base, "xp": {"$gt": xp}})
+    tied = await collection.count_documents({**base, "xp": xp, "user_id": {"$lt": user_id}})
+    return higher + tied
+
+def _after(xp: int, user_id: str) -> dict:
+    return {"$or": [{"xp": {"$lt": xp}}, {"xp": xp, "user_id": {"$gt": user_id}}]}
+
+def _before(xp: int, user_id: str) -> dict:
+    return {"$or": [{"xp": {"$gt": xp}}, {"xp": xp, "user_id": {"$lt": user_id}}]}
+
+async def get_leaderboard(time_filter: str = "all-time", category_filter: str = "all", after: str = None, limit: int = 100):
+    """Get leaderboard data, a page of `limit` entries starting after the `after` cursor"""
+    collection, base = _leaderboard_source(time_filter, category_filter)
+    query = base
+    first_rank = 1
+    if after:
+        xp, user_id = decode_leaderboard_cursor(after)
+        query = {**base, **_after(xp, user_id)}
+        first_rank = await _count_ahead(collection, base, xp, user_id) + 2
+    
+    # Read straight off the xp index
+    cursor = collection.find(query, {"_id": 0}).sort([("xp", DESCENDING), ("user_id", ASCENDING)]).limit(limit)
     
-    cursor = progress_collection.aggregate(pipeline)
     leaderboard = []
     async for entry in cursor:
-        leaderboard.append({
-            "id": entry["user"]["id"],
-            "username": entry["user"]["username"],
-            "display_name": entry["user"]["display_name"],
-            "level": entry["level"],
-            "xp": entry["xp"],
-            "completed_quests": len(entry["completed_quests"]),
-            "achievements": len(entry["achievements"])
-        })
+        leaderboard.append(_public_entry(entry, first_rank + len(leaderboard)))
+    
+    return leaderboard
+
+async def get_leaderboard_rank(user_id: str, time_filter: str = "all-time", category_filter: str = "all", neighbors: int = 5) -> dict:
+    """A user's rank on a leaderboard, with the entries just above and below them"""
+    collection, base = _leaderboard_source(time_filter, category_filter)
+    total = await collection.count_documents(base) if base else await collection.estimated_document_count()
+    entry = await collection.find_one({**base, "user_id": user_id}, {"_id": 0})
+    if not entry:
+        return {"rank": None, "total": total, "entry": None, "above": [], "below": []}
+    
+    xp = entry["xp"]
+    rank = await _count_ahead(collection, base, xp, user_id) + 1
+    
+    above = []
+    cursor = collection.find({**base, **_before(xp, user_id)}, {"_id": 0})
+    async for neighbor in cursor.sort([("xp", ASCENDING), ("user_id", DESCENDING)]).limit(neighbors):
+        above.append(_public_entry(neighbor, rank - len(above) - 1))
+    above.reverse()
+    
+    below = []
+    cursor = collection.find({**base, **_after(xp, user_id)}, {"_id": 0})
+    async for neighbor in cursor.sort([("xp", DESCENDING), ("user_id", ASCENDING)]).limit(neighbors):
+        below.append(_public_entry(neighbor, rank + len(below) + 1))
     
-    return leaderboard
\ No newline at end of file
+    return {"rank": rank, "total": total, "entry": _public_entry(entry, rank), "above": above, "below": below}
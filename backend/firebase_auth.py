@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import re
+import time
+import urllib.request
+from typing import Dict, Optional, Tuple
+
+from jose import JWTError, jwt
+
+from cache import TTLCache
+
+# Public keys Firebase signs ID tokens with, as a JWKS
+GOOGLE_JWKS_URL = "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+
+class InvalidToken(Exception):
+    """Raised for ID tokens that are malformed, expired or not signed by a known key"""
+
+def _fetch_jwks(url: str) -> Tuple[Dict, float]:
+    """Download a JWKS; returns it with its max-age in seconds"""
+    with urllib.request.urlopen(url, timeout=10) as response:
+        jwks = json.loads(response.read())
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    return jwks, float(match.group(1)) if match else 3600.0
+
+class KeySet:
+    """Token signing keys by key id
+
+    Loaded from the Firebase JWKS endpoint and refreshed in the background
+    before the response's max-age runs out, or read once from a local JWKS
+    file (FIREBASE_JWKS_FILE) to verify tokens signed with a stand-in key
+    in development and tests.
+    """
+
+    def __init__(self, url: str = None, path: str = None, min_refresh_interval: float = 60):
+        self.url = url
+        self.path = path
+        self.min_refresh_interval = min_refresh_interval
+        self.keys: Dict[str, Dict] = {}
+        self.expires_at = 0.0
+        self._last_refresh = float("-inf")
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        self._last_refresh = time.monotonic()
+        if self.path:
+            with open(self.path) as f:
+                jwks = json.load(f)
+            max_age = float("inf")
+        else:
+            jwks, max_age = await asyncio.to_thread(_fetch_jwks, self.url)
+        self.keys = {key["kid"]: key for key in jwks["keys"]}
+        self.expires_at = time.monotonic() + max_age
+
+    async def get(self, kid: str) -> Dict:
+        key = self.keys.get(kid)
+        if key is None and time.monotonic() - self._last_refresh >= self.min_refresh_interval:
+            # Not loaded yet, or keys were rotated before our copy expired
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing token signing keys: {e}")
+            key = self.keys.get(kid)
+        if key is None:
+            raise InvalidToken("Token signed with an unknown key")
+        return key
+
+    def start(self):
+        """Keep the keys fresh in the background"""
+        if self._refresher is None:
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing token signing keys: {e}")
+            if self.path:
+                return
+            # Refresh a little before expiry, and retry failures after a minute
+            remaining = self.expires_at - time.monotonic()
+            await asyncio.sleep(max(self.min_refresh_interval, remaining - 300))
+
+class FirebaseTokenVerifier:
+    """Verifies Firebase ID tokens, remembering verified claims until the token expires
+
+    A repeat token costs one LRU lookup; only new tokens are signature-checked,
+    and only an unknown key id can trigger a key download.
+    """
+
+    def __init__(self, project_id: str, keys: KeySet, cache_size: int = None):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.keys = keys
+        # Firebase ID tokens live for an hour at most
+        self._verified = TTLCache(maxsize=cache_size or int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000)), ttl=3600)
+
+    async def verify(self, token: str) -> Dict:
+        """Claims of a valid token; raises InvalidToken otherwise"""
+        claims = self._verified.get(token)
+        if claims is not None and claims["exp"] > time.time():
+            return claims
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            raise InvalidToken(str(e))
+        if header.get("alg") != "RS256":
+            raise InvalidToken("Unexpected token algorithm")
+
+        key = await self.keys.get(header.get("kid"))
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=["RS256"], audience=self.project_id, issuer=self.issuer,
+                # Cached claims are trusted until exp, so a token without one must never get in
+                options={"require_exp": True, "require_iat": True, "require_sub": True}
+            )
+        except JWTError as e:
+            raise InvalidToken(str(e))
+        if not claims.get("sub"):
+            raise InvalidToken("Token has no subject")
+        if claims.get("auth_time", 0) > time.time():
+            raise InvalidToken("Token authenticated in the future")
+
+        self._verified.set(token, claims)
+        return claims
+
+    def cache_stats(self) -> Dict:
+        return self._verified.stats()
+
+def _default_verifier() -> FirebaseTokenVerifier:
+    path = os.getenv("FIREBASE_JWKS_FILE")
+    keys = KeySet(path=path) if path else KeySet(url=os.getenv("FIREBASE_JWKS_URL", GOOGLE_JWKS_URL))
+    return FirebaseTokenVerifier(os.getenv("FIREBASE_PROJECT_ID", ""), keys)
+
+# Initialize the token verifier
+token_verifier = _default_verifier()
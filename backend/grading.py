@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from code_executor import SandboxPool, code_executor
+from database import db, get_all_quests, get_execution_bodies
+
+def _grade_chunk(jobs: List[Dict], test_cases_by_quest: Dict[str, List[Dict]]) -> List[Dict]:
+    """Grade a chunk of stored executions inside a pool worker
+
+    Runs on the worker's copy of the executor, so identical submissions in a
+    cohort are served from that worker's result cache.
+    """
+    graded = []
+    for job in jobs:
+        result = code_executor.execute_code(job["code"], job["quest_id"], test_cases_by_quest.get(job["quest_id"]))
+        graded.append({
+            "id": job["id"],
+            "success": result["success"],
+            "test_results": result["test_results"]
+        })
+    return graded
+
+class RegradeJob:
+    """Progress of one regrade run"""
+
+    def __init__(self, quest_id: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.quest_id = quest_id
+        self.status = "pending"
+        self.total = 0
+        self.processed = 0
+        self.written = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        # The background task of a job started through the API; the loop only keeps weak references
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Submissions graded per second"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "quest_id": self.quest_id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "written": self.written,
+            "elapsed": round(self.elapsed, 2),
+            "throughput": round(self.throughput, 1),
+            "error": self.error
+        }
+
+# Jobs started through the API, by id
+regrade_jobs: Dict[str, RegradeJob] = {}
+
+async def regrade_submissions(
+    job: RegradeJob,
+    workers: int = None,
+    chunk_size: int = 50,
+    write_batch: int = 1000,
+    progress: Callable[[RegradeJob], None] = None
+) -> RegradeJob:
+    """Re-run stored code_executions against the current quest tests and write the results back
+
+    Executions are streamed from Mongo, graded in chunks on a dedicated
+    process pool and written back with unordered bulk writes. Reading pauses
+    whenever the pool is full, so memory stays bounded regardless of cohort size.
+    """
+    workers = workers or int(os.getenv("REGRADE_WORKERS", os.cpu_count() or 2))
+    # The server runs other threads by now; a worker forked while one of them holds a lock
+    # (e.g. a cache's) would deadlock, so the workers start from a clean interpreter
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    pool = SandboxPool(workers=workers, max_queue=workers, start_method=start_method)
+
+    job.status = "running"
+    job.started_at = time.monotonic()
+    query = {"quest_id": job.quest_id} if job.quest_id else {}
+
+    try:
+        # Starting and warming up the workers blocks, keep it off the event loop
+        await asyncio.to_thread(pool.start)
+        test_cases_by_quest = {quest["id"]: quest.get("test_cases") for quest in await get_all_quests()}
+        job.total = await db.code_executions.count_documents(query)
+
+        pending = set()
+        updates: List[UpdateOne] = []
+
+        async def collect(done):
+            for task in done:
+                for graded in task.result():
+                    updates.append(UpdateOne(
+                        {"id": graded["id"]},
+                        {"$set": {
+                            "success": graded["success"],
+                            "test_results": graded["test_results"],
+                            "regraded_at": datetime.utcnow()
+                        }}
+                    ))
+                    job.processed += 1
+            if len(updates) >= write_batch:
+                await flush()
+            if progress:
+                progress(job)
+
+        async def flush():
+            if updates:
+                result = await db.code_executions.bulk_write(list(updates), ordered=False)
+                job.written += result.modified_count
+                updates.clear()
+
+        async def submit(chunk):
+            # Code is stored by hash; executions written before compaction still carry it inline
+            await get_execution_bodies(chunk)
+            gradable = [execution for execution in chunk if execution.get("code") is not None]
+            # Executions whose code blob is missing can't be graded
+            job.total -= len(chunk) - len(gradable)
+            if gradable:
+                pending.add(asyncio.ensure_future(pool.submit(_grade_chunk, gradable, test_cases_by_quest)))
+
+        chunk = []
+        projection = {"_id": 0, "id": 1, "quest_id": 1, "code": 1, "code_hash": 1}
+        cursor = db.code_executions.find(query, projection).batch_size(chunk_size * workers)
+        async for execution in cursor:
+            chunk.append(execution)
+            if len(chunk) < chunk_size:
+                continue
+            await submit(chunk)
+            chunk = []
+            # Backpressure: stop reading from Mongo while every pool slot is taken
+            if len(pending) >= pool.capacity:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                await collect(done)
+
+        if chunk:
+            await submit(chunk)
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            await collect(done)
+        await flush()
+
+        job.status = "completed"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = time.monotonic()
+        pool.shutdown()
+        if progress:
+            progress(job)
+
+    return job
+
+def start_regrade(quest_id: Optional[str] = None) -> RegradeJob:
+    """Start a regrade in the background of the running event loop"""
+    job = RegradeJob(quest_id)
+    regrade_jobs[job.id] = job
+    job.task = asyncio.get_running_loop().create_task(regrade_submissions(job))
+    return job
+
+def _progress_printer(interval: float = 1.0) -> Callable[[RegradeJob], None]:
+    """Progress callback that prints at most once per interval, plus the final state"""
+    last_printed = [0.0]
+
+    def print_progress(job: RegradeJob):
+        now = time.monotonic()
+        if job.status == "running" and now - last_printed[0] < interval:
+            return
+        last_printed[0] = now
+        total = job.total or "?"
+        print(f"[{job.status}] {job.processed}/{total} graded, {job.written} updated, "
+              f"{job.throughput:.1f} submissions/s, {job.elapsed:.1f}s elapsed", flush=True)
+
+    return print_progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Regrade stored code executions against the current quest tests")
+    parser.add_argument("--quest", help="only regrade executions of this quest")
+    parser.add_argument("--workers", type=int, help="number of sandbox worker processes")
+    parser.add_argument("--chunk-size", type=int, default=50, help="executions graded per worker job")
+    parser.add_argument("--write-batch", type=int, default=1000, help="updates per bulk write")
+    args = parser.parse_args()
+
+    job = RegradeJob(args.quest)
+    asyncio.run(regrade_submissions(
+        job,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        write_batch=args.write_batch,
+        progress=_progress_printer()
+    ))
+    if job.status != "completed":
+        raise SystemExit(f"Regrade failed: {job.error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class EncodedPayload:
+    """A JSON response body encoded and compressed once, served many times
+
+    Every representation gets its own strong ETag (the identity tag plus an
+    encoding suffix), and any of them satisfies If-None-Match.
+    """
+
+    def __init__(self, value):
+        self.body = json.dumps(value, default=_json_default, separators=(",", ":")).encode()
+        self.digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{self.digest}"'
+        self.encoded = {}
+        if len(self.body) >= MIN_COMPRESS_BYTES:
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(self.body)
+            self.encoded["gzip"] = gzip.compress(self.body, compresslevel=6)
+
+    def etag_for(self, encoding: str = None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else self.etag
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether an If-None-Match header names any representation of this body"""
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-")[0] == self.digest:
+                return True
+        return False
+
+def _preferred_encoding(accept_encoding: str, available) -> str:
+    """Pick br over gzip when the client accepts it and the payload has it"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+def payload_response(request: Request, payload: EncodedPayload) -> Response:
+    """Serve a pre-encoded payload, answering 304 when the client's copy is current"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and payload.matches(if_none_match):
+        encoding = _preferred_encoding(request.headers.get("accept-encoding", ""), payload.encoded)
+        return Response(status_code=304, headers={"ETag": payload.etag_for(encoding), "Vary": "Accept-Encoding"})
+
+    encoding = _preferred_encoding(request.headers.get("accept-encoding", ""), payload.encoded)
+    headers = {"ETag": payload.etag_for(encoding), "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(content=payload.encoded[encoding], media_type="application/json", headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
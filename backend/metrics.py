@@ -0,0 +1,27 @@
+from collections import deque
+from typing import Dict
+
+class LatencyStats:
+    """Count, mean and percentiles over a sliding window of durations"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self._samples.append(seconds)
+
+    def summary(self) -> Dict:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4),
+            "p50": round(samples[len(samples) // 2], 4),
+            "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+            "max": round(samples[-1], 4)
+        }
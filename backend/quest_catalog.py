@@ -0,0 +1,89 @@
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from database import get_all_quests, get_quests_version, quests_collection
+from http_cache import EncodedPayload
+
+class QuestCatalog:
+    """In-process copy of the active quests, with their responses pre-encoded
+
+    Loaded at startup and reloaded whenever the quests collection changes:
+    through a change stream when Mongo runs as a replica set, otherwise by
+    polling the quests version stamp that every quest write bumps.
+    """
+
+    def __init__(self, poll_interval: float = None):
+        self.poll_interval = poll_interval or float(os.getenv("QUEST_CATALOG_POLL_INTERVAL", 30))
+        self.version = None
+        self._quests: Dict[str, dict] = {}
+        self._ordered: List[dict] = []
+        self._list_payload = EncodedPayload([])
+        self._quest_payloads: Dict[str, EncodedPayload] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """Read all active quests and rebuild every cached payload"""
+        version = await get_quests_version()
+        quests = await get_all_quests()
+        # Build everything first, then swap, so readers never see a half-built catalog
+        quest_payloads = {quest["id"]: EncodedPayload(quest) for quest in quests}
+        self._list_payload = EncodedPayload(quests)
+        self._quest_payloads = quest_payloads
+        self._quests = {quest["id"]: quest for quest in quests}
+        self._ordered = quests
+        self.version = version
+
+    def all(self) -> List[dict]:
+        return self._ordered
+
+    def get(self, quest_id: str) -> Optional[dict]:
+        return self._quests.get(quest_id)
+
+    def list_payload(self) -> EncodedPayload:
+        """Encoded quest list"""
+        return self._list_payload
+
+    def quest_payload(self, quest_id: str) -> Optional[EncodedPayload]:
+        """Encoded single quest"""
+        return self._quest_payloads.get(quest_id)
+
+    def start(self):
+        """Start following quest changes in the background"""
+        if self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self):
+        try:
+            async with quests_collection.watch() as stream:
+                # Catch changes made between the startup load and opening the stream
+                await self.load()
+                async for _ in stream:
+                    await self.load()
+        except PyMongoError as e:
+            # Change streams need a replica set; fall back to the version stamp
+            print(f"Quest change stream unavailable ({e}), polling quest version instead")
+        await self._poll()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await get_quests_version() != self.version:
+                    await self.load()
+            except PyMongoError as e:
+                print(f"Error refreshing quest catalog: {e}")
+
+# Initialize the quest catalog
+quest_catalog = QuestCatalog()
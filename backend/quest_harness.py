@@ -0,0 +1,92 @@
+import re
+import reprlib
+from typing import Callable, Dict, List
+
+# Values in failure messages are abbreviated, a submission can return or raise anything
+_short = reprlib.Repr()
+_short.maxstring = 200
+_short.maxother = 200
+MAX_MESSAGE_LENGTH = 500
+
+def _truncate(text: str) -> str:
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        return text
+    return text[:MAX_MESSAGE_LENGTH] + "..."
+
+class CompiledTestCase:
+    """An executable quest test case, compiled once and run against a submission's namespace
+
+    Test cases are stored on the quest document. Besides the descriptive
+    "description", "test" and "points" fields, an executable test case has:
+    - "call": an expression evaluated in the submission's globals
+    - "expected": the value the expression must equal (defaults to any truthy value)
+    - "expected_stdout": a regular expression searched for in the program output
+    """
+
+    def __init__(self, test_case: Dict):
+        self.description = test_case.get("description", test_case.get("test", "Test case"))
+        self.points = test_case.get("points", 0)
+        self.has_expected = "expected" in test_case
+        self.expected = test_case.get("expected")
+        self.call = None
+        self.stdout_pattern = None
+        self.compile_error = None
+
+        try:
+            if test_case.get("call"):
+                self.call = compile(test_case["call"], f"<test: {self.description}>", "eval")
+            if test_case.get("expected_stdout"):
+                self.stdout_pattern = re.compile(test_case["expected_stdout"])
+        except (SyntaxError, re.error) as e:
+            self.compile_error = f"Invalid test case: {e}"
+
+    def run(self, namespace: Dict, stdout: str) -> Dict:
+        result = {
+            "description": self.description,
+            "passed": False,
+            "points": self.points
+        }
+
+        if self.compile_error:
+            result["message"] = self.compile_error
+            return result
+
+        if self.stdout_pattern is not None and not self.stdout_pattern.search(stdout):
+            result["message"] = "Expected output was not printed"
+            return result
+
+        if self.call is not None:
+            try:
+                actual = eval(self.call, namespace)
+            except Exception as e:
+                result["message"] = _truncate(f"{type(e).__name__}: {e}")
+                return result
+
+            if self.has_expected and actual != self.expected:
+                result["message"] = f"Expected {_short.repr(self.expected)}, got {_short.repr(actual)}"
+                return result
+            if not self.has_expected and not actual:
+                result["message"] = f"Check returned {_short.repr(actual)}"
+                return result
+
+        result["passed"] = True
+        return result
+
+class QuestHarness:
+    """All executable test cases of one quest"""
+
+    def __init__(self, test_cases: List[Dict]):
+        self.tests = [CompiledTestCase(tc) for tc in test_cases if is_executable(tc)]
+
+    def run(self, namespace: Dict, stdout: str, on_result: Callable[[Dict], None] = None) -> List[Dict]:
+        results = []
+        for test in self.tests:
+            result = test.run(namespace, stdout)
+            results.append(result)
+            if on_result:
+                on_result(result)
+        return results
+
+def is_executable(test_case: Dict) -> bool:
+    """Whether a test case can be run, as opposed to being a description only"""
+    return bool(test_case.get("call") or test_case.get("expected_stdout"))
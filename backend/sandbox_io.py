@@ -0,0 +1,52 @@
+# Callables handed to user code. Their __globals__ are this module's, so it
+# deliberately imports nothing: no path leads from them to os, sys or the server.
+
+class OutputBuffer:
+    """Per-execution stdout sink with a byte cap, so concurrent runs never share sys.stdout"""
+
+    def __init__(self, max_bytes, on_write=None):
+        self.max_bytes = max_bytes
+        self.on_write = on_write
+        self.truncated = False
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        if self.truncated:
+            return len(text)
+
+        data = text.encode("utf-8", "replace")
+        remaining = self.max_bytes - self._size
+        if len(data) > remaining:
+            # Keep what fits without splitting a multi-byte character
+            data = data[:remaining]
+            text = data.decode("utf-8", "ignore")
+            self.truncated = True
+
+        self._parts.append(text)
+        self._size += len(data)
+        if self.on_write and text:
+            self.on_write(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self._parts)
+
+def make_print(sink):
+    """Build a print() for user code that always writes to this run's sink"""
+    def sandbox_print(*args, sep=' ', end='\n', file=None, flush=False):
+        print(*args, sep=sep, end=end, file=sink)
+    return sandbox_print
+
+def make_import(allowed_modules):
+    """Build an __import__ for user code, limited to the given top-level modules"""
+    allowed_modules = frozenset(allowed_modules)
+
+    def sandbox_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name.split(".")[0] not in allowed_modules:
+            raise ImportError(f"Import of '{name}' is not allowed")
+        return __import__(name, globals, locals, fromlist, level)
+    return sandbox_import
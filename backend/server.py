@@ -1,21 +1,30 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import os
+import json
+import re
 import uvicorn
 import asyncio
-from datetime import datetime
 
 # Import our modules
 from database import (
-    init_db, create_user, get_user_by_uid, get_user_progress, 
-    update_user_progress, get_all_quests, get_quest_by_id,
-    save_code_execution, get_leaderboard
+    init_db, create_user, get_user_by_uid, get_progress_by_uid,
+    apply_progress_events, save_code_execution, get_leaderboard, get_leaderboard_rank,
+    encode_leaderboard_cursor,
+    WRITE_BEHIND_BUFFERS
 )
-from code_executor import code_executor
+from code_executor import code_executor, ExecutorSaturated
 from ai_hints import ai_hint_generator
+from grading import regrade_jobs, start_regrade
+from quest_catalog import quest_catalog
+from concepts import concept_store, MAX_CONCEPT_LENGTH
+from http_cache import EncodedPayload, payload_response
+from cache import TTLCache
+from firebase_auth import InvalidToken, token_verifier
 
 app = FastAPI(title="CodeQuest API", version="1.0.0")
 
@@ -26,6 +35,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Environment variables
@@ -33,10 +43,25 @@ MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/codequest")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+# Firebase UIDs allowed to use instructor endpoints, comma separated
+INSTRUCTOR_UIDS = {uid.strip() for uid in os.getenv("INSTRUCTOR_UIDS", "").split(",") if uid.strip()}
 
 # Security
 security = HTTPBearer()
 
+# Progress sync: client ids end up in a field name, so keep them to a safe alphabet
+PROGRESS_CLIENT_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+MAX_PROGRESS_EVENTS = 200
+
+# Achievement ids are short slugs; anything else is a client inventing labels
+ACHIEVEMENT_ID = re.compile(r"^[a-z0-9_-]{1,64}$")
+
+# Encoded leaderboard pages per (timeFilter, categoryFilter, after), briefly reused
+leaderboard_payloads = TTLCache(maxsize=256, ttl=float(os.getenv("LEADERBOARD_CACHE_TTL", 10)))
+
+# Entries per leaderboard page
+LEADERBOARD_PAGE_SIZE = 100
+
 # Pydantic models
 class UserCreate(BaseModel):
     uid: str
@@ -56,41 +81,74 @@ class HintRequest(BaseModel):
     code: str
     user_progress: Optional[Dict] = None
 
-class ProgressUpdate(BaseModel):
-    level: int
-    xp: int
-    completed_quests: List[str]
-    current_quest: Optional[str] = None
-    achievements: List[str] = []
+class RegradeRequest(BaseModel):
+    quest_id: Optional[str] = None
+
+class ProgressEvent(BaseModel):
+    type: str  # quest_completed, quest_started or achievement_earned
+    quest_id: Optional[str] = None
+    achievement: Optional[str] = None
+    seq: Optional[int] = None  # client sequence number, required by /api/user/progress/sync
+
+class ProgressSync(BaseModel):
+    client_id: str
+    events: List[ProgressEvent]
 
 # Authentication dependency
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from token"""
     try:
-        # For now, we'll use a simple approach
-        # In production, you would verify the Firebase token here
         token = credentials.credentials
         
-        # Mock user verification - replace with actual Firebase token verification
         if token == "guest-token":
             return {"uid": "guest", "email": "guest@codequest.com", "username": "Guest"}
         
-        # For registered users, you would verify the Firebase token
-        # and extract user information
-        return {"uid": "user123", "email": "user@example.com", "username": "User"}
+        # Verified Firebase ID token; repeat tokens are served from the verified-claims cache
+        claims = await token_verifier.verify(token)
+        email = claims.get("email")
+        return {
+            "uid": claims["sub"],
+            "email": email,
+            "username": claims.get("name") or (email.split("@")[0] if email else "User")
+        }
         
-    except Exception as e:
+    except InvalidToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def get_instructor_user(current_user: dict = Depends(get_current_user)):
+    """Require the current user to be an instructor"""
+    if current_user["uid"] not in INSTRUCTOR_UIDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Instructor access required")
+    return current_user
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    # Fork the sandbox workers before anything else opens sockets or threads
+    code_executor.start_pool()
+    token_verifier.keys.start()
     await init_db()
+    for writer in WRITE_BEHIND_BUFFERS.values():
+        writer.start()
+    await quest_catalog.load()
+    quest_catalog.start()
+    await concept_store.load()
+
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers on shutdown"""
+    await quest_catalog.stop()
+    await token_verifier.keys.stop()
+    code_executor.shutdown_pool()
+    # Write out queued executions and hints before the process exits
+    for writer in WRITE_BEHIND_BUFFERS.values():
+        await writer.stop()
 
 # Basic routes
 @app.get("/")
@@ -101,6 +159,25 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "CodeQuest Backend"}
 
+@app.get("/api/metrics")
+async def metrics():
+    """Cache and worker pool counters"""
+    return {
+        "code_executor": {
+            "pool": {
+                "workers": code_executor.pool.workers,
+                "in_flight": code_executor.pool.in_flight,
+                "capacity": code_executor.pool.capacity
+            },
+            "cache": code_executor.cache_stats()
+        },
+        "leaderboard_cache": leaderboard_payloads.stats(),
+        "auth_cache": token_verifier.cache_stats(),
+        "hint_cache": ai_hint_generator.cache_stats(),
+        "llm": ai_hint_generator.gateway.stats(),
+        "write_behind": {name: writer.stats() for name, writer in WRITE_BEHIND_BUFFERS.items()}
+    }
+
 # Authentication routes
 @app.post("/api/auth/register")
 async def register(user: UserCreate):
@@ -142,24 +219,17 @@ async def guest_login():
 
 # Quest routes
 @app.get("/api/quests")
-async def get_quests():
+async def get_quests(request: Request):
     """Get all quests"""
-    try:
-        quests = await get_all_quests()
-        return quests
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return payload_response(request, quest_catalog.list_payload())
 
 @app.get("/api/quests/{quest_id}")
-async def get_quest(quest_id: str):
+async def get_quest(quest_id: str, request: Request):
     """Get a specific quest"""
-    try:
-        quest = await get_quest_by_id(quest_id)
-        if not quest:
-            raise HTTPException(status_code=404, detail="Quest not found")
-        return quest
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    payload = quest_catalog.quest_payload(quest_id)
+    if not payload:
+        raise HTTPException(status_code=404, detail="Quest not found")
+    return payload_response(request, payload)
 
 # Code execution routes
 @app.post("/api/code/execute")
@@ -169,8 +239,10 @@ async def execute_code(
 ):
     """Execute user code"""
     try:
-        # Execute the code
-        result = code_executor.execute_code(request.code, request.quest_id)
+        # Execute the code on the sandbox pool, together with the quest's test cases
+        quest = quest_catalog.get(request.quest_id)
+        test_cases = quest.get("test_cases") if quest else None
+        result = await code_executor.execute_code_async(request.code, request.quest_id, test_cases)
         
         # Save execution result
         if current_user["uid"] != "guest":
@@ -186,8 +258,84 @@ async def execute_code(
         
         return result
         
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data: Dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/code/execute/stream")
+async def execute_code_stream(
+    request: CodeExecutionRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Execute user code, streaming stdout chunks and test results as server-sent events"""
+    quest = quest_catalog.get(request.quest_id)
+    test_cases = quest.get("test_cases") if quest else None
+    frames = code_executor.stream_code(request.code, request.quest_id, test_cases)
+    
+    # Pull the first frame before responding, so a saturated pool is still a 503
+    try:
+        first_frame = await frames.__anext__()
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        frame = first_frame
+        try:
+            while True:
+                if frame["type"] == "stdout":
+                    yield _sse("stdout", {"data": frame["data"]})
+                elif frame["type"] == "test":
+                    yield _sse("test", frame["result"])
+                else:
+                    result = frame["result"]
+                    yield _sse("summary", result)
+                    if current_user["uid"] != "guest":
+                        await save_code_execution(
+                            user_id=current_user["uid"],
+                            quest_id=request.quest_id,
+                            code=request.code,
+                            output=result["output"],
+                            success=result["success"],
+                            execution_time=result["execution_time"],
+                            test_results=result["test_results"]
+                        )
+                try:
+                    frame = await frames.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            # Kills the sandbox child if the client went away mid-run
+            await frames.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _hint_progress(request: HintRequest, current_user: dict) -> Dict:
+    """Progress sent with a hint request, or a fresh player's"""
+    return request.user_progress or {
+        "user_id": current_user["uid"],
+        "level": 1,
+        "xp": 0,
+        "completed_quests": []
+    }
 
 @app.post("/api/code/hint")
 async def get_code_hint(
@@ -197,12 +345,7 @@ async def get_code_hint(
     """Get AI-powered hint"""
     try:
         # Prepare user progress
-        user_progress = request.user_progress or {
-            "user_id": current_user["uid"],
-            "level": 1,
-            "xp": 0,
-            "completed_quests": []
-        }
+        user_progress = _hint_progress(request, current_user)
         
         # Generate hint
         hint = await ai_hint_generator.generate_hint(
@@ -217,6 +360,35 @@ async def get_code_hint(
         print(f"Error in hint generation: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate hint")
 
+@app.post("/api/code/hint/stream")
+async def stream_code_hint(
+    request: HintRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get AI-powered hint, streamed as server-sent events while it is generated"""
+    user_progress = _hint_progress(request, current_user)
+    
+    async def event_stream():
+        chunks = []
+        try:
+            async for chunk in ai_hint_generator.stream_hint(
+                quest_id=request.quest_id,
+                user_code=request.code,
+                user_progress=user_progress
+            ):
+                chunks.append(chunk)
+                yield _sse("token", {"text": chunk})
+            yield _sse("done", {"hint": "".join(chunks)})
+        except Exception as e:
+            print(f"Error in hint streaming: {e}")
+            yield _sse("error", {"detail": "Failed to generate hint"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # User progress routes
 @app.get("/api/user/progress")
 async def get_user_progress_route(current_user: dict = Depends(get_current_user)):
@@ -231,72 +403,168 @@ async def get_user_progress_route(current_user: dict = Depends(get_current_user)
                 "achievements": []
             }
         
-        user = await get_user_by_uid(current_user["uid"])
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        progress = await get_user_progress(user["id"])
+        progress = await get_progress_by_uid(current_user["uid"])
         if not progress:
             raise HTTPException(status_code=404, detail="User progress not found")
         
-        return {
-            "level": progress["level"],
-            "xp": progress["xp"],
-            "completed_quests": progress["completed_quests"],
-            "current_quest": progress["current_quest"],
-            "achievements": progress["achievements"]
-        }
+        return _progress_response(progress)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/user/progress")
-async def update_user_progress_route(
-    progress: ProgressUpdate,
+@app.post("/api/user/progress/events")
+async def record_progress_event_route(
+    event: ProgressEvent,
     current_user: dict = Depends(get_current_user)
 ):
-    """Update user progress"""
+    """Apply one progress event server-side and return the resulting progress"""
+    if current_user["uid"] == "guest":
+        return {"message": "Guest progress updated locally"}
+    
+    resolved = _resolve_progress_event(event)
     try:
-        if current_user["uid"] == "guest":
-            return {"message": "Guest progress updated locally"}
-        
-        user = await get_user_by_uid(current_user["uid"])
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        await update_user_progress(user["id"], {
-            "level": progress.level,
-            "xp": progress.xp,
-            "completed_quests": progress.completed_quests,
-            "current_quest": progress.current_quest,
-            "achievements": progress.achievements,
-            "last_activity": datetime.utcnow()
-        })
-        
-        return {"message": "Progress updated successfully"}
-        
+        progress = await apply_progress_events(current_user["uid"], [resolved])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not progress:
+        raise HTTPException(status_code=404, detail="User progress not found")
+    return _progress_response(progress)
+
+@app.post("/api/user/progress/sync")
+async def sync_progress_events_route(
+    batch: ProgressSync,
+    current_user: dict = Depends(get_current_user)
+):
+    """Apply a batch of sequenced progress events in one write and return the merged progress
+    
+    Safe to retry: events at or below the client's last acknowledged
+    sequence number are skipped. last_seq tells the client which queued
+    events it can drop.
+    """
+    if current_user["uid"] == "guest":
+        return {"message": "Guest progress updated locally"}
+    
+    if not PROGRESS_CLIENT_ID.match(batch.client_id):
+        raise HTTPException(status_code=400, detail="Invalid client_id")
+    if len(batch.events) > MAX_PROGRESS_EVENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PROGRESS_EVENTS} events per batch")
+    seqs = [event.seq for event in batch.events]
+    if any(seq is None or seq < 0 for seq in seqs) or seqs != sorted(set(seqs)):
+        raise HTTPException(status_code=400, detail="Events need increasing, non-negative seq numbers")
+    
+    events = []
+    for event in batch.events:
+        resolved = _resolve_progress_event(event)
+        resolved["seq"] = event.seq
+        events.append(resolved)
+    
+    try:
+        progress = await apply_progress_events(current_user["uid"], events, client_id=batch.client_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not progress:
+        raise HTTPException(status_code=404, detail="User progress not found")
+    
+    response = _progress_response(progress)
+    response["last_seq"] = progress.get("event_seqs", {}).get(batch.client_id)
+    return response
+
+def _resolve_progress_event(event: ProgressEvent) -> Dict:
+    """Validate an event and fill in what the server decides, like a quest's xp reward"""
+    if event.type in ("quest_completed", "quest_started"):
+        quest = quest_catalog.get(event.quest_id) if event.quest_id else None
+        if not quest:
+            raise HTTPException(status_code=400, detail=f"Unknown quest: {event.quest_id}")
+        return {"type": event.type, "quest_id": quest["id"], "xp": quest["xp_reward"], "category": quest["category"]}
+    if event.type == "achievement_earned":
+        if not event.achievement or not ACHIEVEMENT_ID.match(event.achievement):
+            raise HTTPException(status_code=400, detail="achievement must be an id of up to 64 lowercase letters, digits, _ or -")
+        return {"type": event.type, "achievement": event.achievement}
+    raise HTTPException(status_code=400, detail=f"Unknown progress event type: {event.type}")
+
+def _progress_response(progress: Dict) -> Dict:
+    return {
+        "level": progress["level"],
+        "xp": progress["xp"],
+        "completed_quests": progress["completed_quests"],
+        "current_quest": progress["current_quest"],
+        "achievements": progress["achievements"]
+    }
 
 # Leaderboard routes
 @app.get("/api/leaderboard")
 async def get_leaderboard_route(
+    request: Request,
     timeFilter: str = "all-time",
-    categoryFilter: str = "all"
+    categoryFilter: str = "all",
+    after: Optional[str] = None
 ):
-    """Get leaderboard"""
+    """Get leaderboard; a full page sets X-Next-Cursor, to be passed back as ?after="""
     try:
-        leaderboard = await get_leaderboard(timeFilter, categoryFilter)
-        return leaderboard
+        key = (timeFilter, categoryFilter, after)
+        cached = leaderboard_payloads.get(key)
+        if cached is None:
+            entries = await get_leaderboard(timeFilter, categoryFilter, after=after, limit=LEADERBOARD_PAGE_SIZE)
+            next_cursor = None
+            if len(entries) == LEADERBOARD_PAGE_SIZE:
+                next_cursor = encode_leaderboard_cursor(entries[-1]["xp"], entries[-1]["id"])
+            cached = (EncodedPayload(entries), next_cursor)
+            leaderboard_payloads.set(key, cached)
+        payload, next_cursor = cached
+        response = payload_response(request, payload)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/leaderboard/me")
+async def get_my_rank_route(
+    timeFilter: str = "all-time",
+    categoryFilter: str = "all",
+    neighbors: int = 5,
+    current_user: dict = Depends(get_current_user)
+):
+    """Current user's rank, with the players just above and below"""
+    user = await get_user_by_uid(current_user["uid"])
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        return await get_leaderboard_rank(user["id"], timeFilter, categoryFilter, neighbors=max(1, min(neighbors, 25)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Instructor routes
+@app.post("/api/admin/regrade")
+async def regrade_route(
+    request: RegradeRequest,
+    current_user: dict = Depends(get_instructor_user)
+):
+    """Regrade stored executions against the current quest tests in the background"""
+    job = start_regrade(request.quest_id)
+    return job.to_dict()
+
+@app.get("/api/admin/regrade/{job_id}")
+async def regrade_status_route(
+    job_id: str,
+    current_user: dict = Depends(get_instructor_user)
+):
+    """Progress and throughput of a regrade job"""
+    job = regrade_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Regrade job not found")
+    return job.to_dict()
+
 # Additional utility routes
 @app.get("/api/concepts/{concept}")
 async def get_concept_explanation(concept: str):
     """Get explanation for a Python concept"""
+    if len(concept) > MAX_CONCEPT_LENGTH:
+        raise HTTPException(status_code=400, detail="Concept name too long")
     try:
-        explanation = await ai_hint_generator.generate_explanation("", concept)
+        explanation = await concept_store.get(concept)
         return {"concept": concept, "explanation": explanation}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
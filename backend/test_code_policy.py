@@ -0,0 +1,108 @@
+import ast
+
+from code_executor import CodeExecutor
+from code_policy import check_policy
+
+# Walks from a generator's frame to the frame that runs the sandbox and calls os through its globals
+FRAME_ESCAPE = """
+def g():
+    yield gen.gi_frame.f_back
+
+gen = g()
+for fr in gen:
+    print(fr.f_back.f_globals["os"].getpid())
+"""
+
+# The same walk through class patterns, which read attributes without an ast.Attribute
+MATCH_ESCAPE = """
+def g():
+    match gen:
+        case T(gi_frame=me):
+            F = type(me)
+            match me:
+                case F(f_back=caller):
+                    match caller:
+                        case F(f_back=runner):
+                            match runner:
+                                case F(f_globals=glb):
+                                    yield glb["os"].getpid()
+
+gen = g()
+T = type(gen)
+for pid in gen:
+    print(pid)
+"""
+
+# And through format fields, which str.format resolves at runtime
+FORMAT_ESCAPE = """
+def g():
+    yield "{0.gi_frame.f_back.f_back.f_globals[os].environ}".format(gen)
+
+gen = g()
+for environ in gen:
+    print(environ)
+"""
+
+def _messages(code):
+    return [violation["message"] for violation in check_policy(ast.parse(code))]
+
+def test_frame_escape_is_rejected_by_policy():
+    messages = [violation["message"] for violation in check_policy(ast.parse(FRAME_ESCAPE))]
+    assert "access to attribute 'gi_frame' is not allowed" in messages
+    assert "access to attribute 'f_back' is not allowed" in messages
+    assert "access to attribute 'f_globals' is not allowed" in messages
+
+def test_frame_escape_does_not_run():
+    executor = CodeExecutor(isolation="subprocess")
+    result = executor.execute_code(FRAME_ESCAPE, "frame-escape")
+    assert not result["success"]
+    assert result["output"].startswith("Code contains potentially dangerous operations")
+    assert len(result["violations"]) >= 3
+
+def test_getattr_with_frame_attribute_is_rejected():
+    code = "def g():\n    yield 1\n\nframe = getattr(g(), 'gi_frame')\n"
+    messages = [violation["message"] for violation in check_policy(ast.parse(code))]
+    assert messages == ["access to attribute 'gi_frame' is not allowed"]
+
+def test_match_class_escape_is_rejected():
+    messages = _messages(MATCH_ESCAPE)
+    assert "access to attribute 'gi_frame' is not allowed" in messages
+    assert "access to attribute 'f_globals' is not allowed" in messages
+
+    result = CodeExecutor(isolation="subprocess").execute_code(MATCH_ESCAPE, "match-escape")
+    assert not result["success"]
+    assert result["output"].startswith("Code contains potentially dangerous operations")
+
+def test_format_escape_is_rejected():
+    messages = _messages(FORMAT_ESCAPE)
+    assert "access to attribute 'gi_frame' is not allowed" in messages
+    assert "access to attribute 'f_globals' is not allowed" in messages
+
+    result = CodeExecutor(isolation="subprocess").execute_code(FORMAT_ESCAPE, "format-escape")
+    assert not result["success"]
+    assert result["output"].startswith("Code contains potentially dangerous operations")
+
+def test_format_of_print_globals_is_rejected():
+    assert _messages('print("{0.__globals__[os]}".format(print))') == [
+        "access to attribute '__globals__' is not allowed"
+    ]
+
+def test_format_needs_a_literal_template():
+    assert _messages("template = '{0}'\nprint(template.format(1))") == [
+        "format() is only allowed on a string literal"
+    ]
+    assert _messages("print(getattr('{0}', 'format_map')({}))") == [
+        "format_map() is only allowed on a string literal"
+    ]
+
+def test_plain_format_and_match_are_allowed():
+    code = """
+Complex = type(1j)
+match 3 + 2j:
+    case Complex(real=3, imag=y):
+        print("{0} {1:>{width}} {z.real}".format("y =", y, width=4, z=1j))
+"""
+    assert _messages(code) == []
+    result = CodeExecutor(isolation="subprocess").execute_code(code, "plain-format")
+    assert result["success"]
+    assert result["output"] == "y =  2.0 0.0\n"
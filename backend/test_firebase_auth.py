@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from firebase_auth import InvalidToken, _default_verifier
+
+PROJECT_ID = "codequest-test"
+KID = "stand-in-key"
+
+@pytest.fixture(scope="module")
+def signing_key() -> bytes:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+
+@pytest.fixture
+def verifier(signing_key, tmp_path, monkeypatch):
+    """A verifier built from the environment, trusting only the stand-in key"""
+    public_key = jwk.construct(signing_key, "RS256").public_key().to_dict()
+    jwks_file = tmp_path / "jwks.json"
+    jwks_file.write_text(json.dumps({"keys": [dict(public_key, kid=KID, use="sig")]}))
+    monkeypatch.setenv("FIREBASE_JWKS_FILE", str(jwks_file))
+    monkeypatch.setenv("FIREBASE_PROJECT_ID", PROJECT_ID)
+    return _default_verifier()
+
+def _token(signing_key: bytes, kid: str = KID, **overrides) -> str:
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "user-1",
+        "email": "ada@example.com",
+        "auth_time": now - 60,
+        "iat": now - 60,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    claims = {name: value for name, value in claims.items() if value is not None}
+    return jwt.encode(claims, signing_key.decode(), algorithm="RS256", headers={"kid": kid})
+
+def test_valid_token(verifier, signing_key):
+    claims = asyncio.run(verifier.verify(_token(signing_key)))
+    assert claims["sub"] == "user-1"
+    assert claims["email"] == "ada@example.com"
+
+def test_repeat_token_is_served_from_cache(verifier, signing_key):
+    token = _token(signing_key)
+    asyncio.run(verifier.verify(token))
+    assert asyncio.run(verifier.verify(token))["sub"] == "user-1"
+    stats = verifier.cache_stats()
+    assert stats["hits"] == 1
+    assert stats["size"] == 1
+
+def test_wrong_audience_is_rejected(verifier, signing_key):
+    with pytest.raises(InvalidToken):
+        asyncio.run(verifier.verify(_token(signing_key, aud="another-project")))
+
+def test_unknown_key_id_is_rejected(verifier, signing_key):
+    with pytest.raises(InvalidToken, match="unknown key"):
+        asyncio.run(verifier.verify(_token(signing_key, kid="rotated-away")))
+
+def test_expired_token_is_rejected(verifier, signing_key):
+    now = int(time.time())
+    with pytest.raises(InvalidToken):
+        asyncio.run(verifier.verify(_token(signing_key, iat=now - 7200, exp=now - 3600)))
+
+def test_token_without_exp_is_rejected_and_not_cached(verifier, signing_key):
+    token = _token(signing_key, exp=None)
+    for _ in range(2):
+        with pytest.raises(InvalidToken):
+            asyncio.run(verifier.verify(token))
+    assert verifier.cache_stats()["size"] == 0
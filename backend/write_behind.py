@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from metrics import LatencyStats
+
+class WriteBehindBuffer:
+    """Batches inserts into one collection and writes them in the background
+
+    insert() only queues the document; a background task writes the queue
+    with insert_many every flush_interval seconds, or as soon as flush_size
+    documents are waiting. At most max_pending documents are held; beyond
+    that new documents are dropped and counted. Before start() (scripts,
+    jobs) insert() writes straight through.
+    """
+
+    def __init__(self, collection, flush_size: int = None, flush_interval: float = None, max_pending: int = None):
+        self.collection = collection
+        self.flush_size = flush_size or int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", 100))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 1.0))
+        self.max_pending = max_pending or int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+        self._pending = deque()  # (enqueued at, document)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.lag = LatencyStats()  # seconds between insert() and the write
+
+    async def insert(self, document: Dict):
+        if self._task is None:
+            await self._write([document])
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((time.monotonic(), document))
+        self.enqueued += 1
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Never let one bad flush end the task, later inserts would only pile up
+                print(f"Error flushing {self.collection.name}: {e}")
+
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing {self.collection.name}: {e}")
+        if self._pending:
+            print(f"Dropping {len(self._pending)} unwritten documents for {self.collection.name}")
+            self.dropped += len(self._pending)
+            self._pending.clear()
+
+    async def flush(self):
+        """Write queued documents in batches of flush_size"""
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.flush_size, len(self._pending)))]
+            try:
+                await self._write([document for _, document in batch])
+                written = len(batch)
+            except BulkWriteError as e:
+                # Rejected documents (duplicate ids, validation) would fail again
+                written = len(batch) - len(e.details.get("writeErrors", []))
+                self.dropped += len(batch) - written
+            except PyMongoError as e:
+                print(f"Error writing to {self.collection.name}: {e}")
+                self.failed_flushes += 1
+                # Keep the batch for the next flush, as long as the queue has room
+                room = max(0, self.max_pending - len(self._pending))
+                self.dropped += max(0, len(batch) - room)
+                self._pending.extendleft(reversed(batch[:room]))
+                return
+            except Exception as e:
+                # Not a database error: some document can't be written at all (e.g. unencodable
+                # text), so write the batch one by one and drop only the ones that fail
+                print(f"Error writing to {self.collection.name}, retrying documents one by one: {e}")
+                written = 0
+                for _, document in batch:
+                    try:
+                        await self._write([document])
+                        written += 1
+                    except Exception as e:
+                        print(f"Dropping a document for {self.collection.name}: {e}")
+                self.dropped += len(batch) - written
+
+            self.written += written
+            now = time.monotonic()
+            for enqueued_at, _ in batch:
+                self.lag.record(now - enqueued_at)
+
+    async def _write(self, documents: List[Dict]):
+        """Write one batch; subclasses can transform documents or write related data first"""
+        await self.collection.insert_many(documents, ordered=False)
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+            "lag": self.lag.summary()
+        }
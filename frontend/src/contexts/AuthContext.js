@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useEffect, useState } from 'react';
+import React, { createContext, useContext, useEffect, useRef, useState } from 'react';
 import { 
   signInWithEmailAndPassword, 
   createUserWithEmailAndPassword,
@@ -19,6 +19,39 @@ export const useAuth = () => {
   return context;
 };
 
+// Progress as the backend returns it, in the shape the app uses
+const fromServerProgress = (data) => ({
+  level: data.level,
+  xp: data.xp,
+  completedQuests: data.completed_quests,
+  currentQuest: data.current_quest,
+  achievements: data.achievements
+});
+
+// Progress events are queued here and sent in batches to /api/user/progress/sync
+const PROGRESS_QUEUE_KEY = 'pendingProgressEvents';
+const PROGRESS_SYNC_DELAY = 500;
+const PROGRESS_SYNC_MAX_BACKOFF = 30000;
+const PROGRESS_SYNC_BATCH = 200;
+
+// Stable id of this browser, so the server can tell its event sequence numbers apart
+const getProgressClientId = () => {
+  let clientId = localStorage.getItem('progressClientId');
+  if (!clientId) {
+    clientId = `web-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    localStorage.setItem('progressClientId', clientId);
+  }
+  return clientId;
+};
+
+const loadProgressQueue = () => {
+  try {
+    return JSON.parse(localStorage.getItem(PROGRESS_QUEUE_KEY)) || [];
+  } catch (error) {
+    return [];
+  }
+};
+
 export const AuthProvider = ({ children }) => {
   const [currentUser, setCurrentUser] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -33,6 +66,12 @@ export const AuthProvider = ({ children }) => {
   // Configure axios defaults
   const backendUrl = process.env.REACT_APP_BACKEND_URL;
   
+  // Unsent progress events, kept across reloads until the server acknowledges them
+  const progressQueue = useRef(loadProgressQueue());
+  const syncTimer = useRef(null);
+  const syncing = useRef(false);
+  const syncBackoff = useRef(PROGRESS_SYNC_DELAY);
+  
   useEffect(() => {
     const unsubscribe = onAuthStateChanged(auth, async (user) => {
       if (user) {
@@ -43,7 +82,7 @@ export const AuthProvider = ({ children }) => {
           const response = await axios.get(`${backendUrl}/api/user/progress`, {
             headers: { Authorization: `Bearer ${token}` }
           });
-          setUserProgress(response.data);
+          setUserProgress(fromServerProgress(response.data));
         } catch (error) {
           console.error('Error fetching user progress:', error);
         }
@@ -96,6 +135,10 @@ export const AuthProvider = ({ children }) => {
   const logout = async () => {
     try {
       await signOut(auth);
+      // Unsent events belong to the account that just signed out
+      clearTimeout(syncTimer.current);
+      progressQueue.current = [];
+      localStorage.removeItem(PROGRESS_QUEUE_KEY);
     } catch (error) {
       throw error;
     }
@@ -118,24 +161,90 @@ export const AuthProvider = ({ children }) => {
     });
   };
 
-  const updateUserProgress = async (progressData) => {
-    if (currentUser && !currentUser.isGuest) {
-      try {
-        const token = await currentUser.getIdToken();
-        await axios.post(`${backendUrl}/api/user/progress`, progressData, {
-          headers: { Authorization: `Bearer ${token}` }
-        });
-        setUserProgress(progressData);
-      } catch (error) {
-        console.error('Error updating progress:', error);
-      }
-    } else {
-      // Update local storage for guest users
-      setUserProgress(progressData);
+  // Guest progress only lives in local storage; signed-in progress changes
+  // go through recordProgressEvent, the server computes xp and level itself
+  const updateUserProgress = (progressData) => {
+    setUserProgress(progressData);
+    if (!currentUser || currentUser.isGuest) {
       localStorage.setItem('guestProgress', JSON.stringify(progressData));
     }
   };
 
+  const saveProgressQueue = () => {
+    localStorage.setItem(PROGRESS_QUEUE_KEY, JSON.stringify(progressQueue.current));
+  };
+
+  const scheduleProgressSync = (delay) => {
+    clearTimeout(syncTimer.current);
+    syncTimer.current = setTimeout(syncProgressEvents, delay);
+  };
+
+  // Send every queued event in one request; on failure retry with backoff
+  const syncProgressEvents = async () => {
+    if (syncing.current || !currentUser || currentUser.isGuest || progressQueue.current.length === 0) {
+      return;
+    }
+    syncing.current = true;
+    try {
+      const token = await currentUser.getIdToken();
+      const response = await axios.post(`${backendUrl}/api/user/progress/sync`, {
+        client_id: getProgressClientId(),
+        events: progressQueue.current.slice(0, PROGRESS_SYNC_BATCH)
+      }, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      
+      const lastSeq = response.data.last_seq;
+      progressQueue.current = progressQueue.current.filter(event => lastSeq == null || event.seq > lastSeq);
+      saveProgressQueue();
+      syncBackoff.current = PROGRESS_SYNC_DELAY;
+      if (progressQueue.current.length === 0) {
+        setUserProgress(fromServerProgress(response.data));
+      }
+    } catch (error) {
+      console.error('Error syncing progress:', error);
+      if (error.response && error.response.status === 400) {
+        // The server rejected the batch itself; resending it can't succeed
+        progressQueue.current = progressQueue.current.slice(PROGRESS_SYNC_BATCH);
+        saveProgressQueue();
+      } else {
+        syncBackoff.current = Math.min(syncBackoff.current * 2, PROGRESS_SYNC_MAX_BACKOFF);
+      }
+    }
+    syncing.current = false;
+    
+    if (progressQueue.current.length > 0) {
+      scheduleProgressSync(syncBackoff.current);
+    }
+  };
+
+  // Send events left over from an earlier visit
+  useEffect(() => {
+    if (currentUser && !currentUser.isGuest && progressQueue.current.length > 0) {
+      scheduleProgressSync(PROGRESS_SYNC_DELAY);
+    }
+    return () => clearTimeout(syncTimer.current);
+  }, [currentUser]);
+
+  // Report a progress event (quest_completed, quest_started, achievement_earned).
+  // The expected progress is shown right away; events are batched and the
+  // server's merged progress replaces it once everything is acknowledged.
+  const recordProgressEvent = (event, expectedProgress) => {
+    if (!currentUser || currentUser.isGuest) {
+      updateUserProgress(expectedProgress);
+      return;
+    }
+    
+    setUserProgress(expectedProgress);
+    const queue = progressQueue.current;
+    const lastSeq = Number(localStorage.getItem('progressSeq') || 0);
+    const seq = Math.max(lastSeq, queue.length ? queue[queue.length - 1].seq : 0) + 1;
+    localStorage.setItem('progressSeq', String(seq));
+    progressQueue.current = [...queue, { ...event, seq }];
+    saveProgressQueue();
+    scheduleProgressSync(PROGRESS_SYNC_DELAY);
+  };
+
   const value = {
     currentUser,
     userProgress,
@@ -143,7 +252,8 @@ export const AuthProvider = ({ children }) => {
     login,
     logout,
     startGuestSession,
-    updateUserProgress
+    updateUserProgress,
+    recordProgressEvent
   };
 
   return (
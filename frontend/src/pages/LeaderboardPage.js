@@ -18,9 +18,13 @@ const LeaderboardPage = () => {
   const [loading, setLoading] = useState(true);
   const [timeFilter, setTimeFilter] = useState('all-time');
   const [categoryFilter, setCategoryFilter] = useState('all');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [myRank, setMyRank] = useState(null);
 
   useEffect(() => {
     fetchLeaderboard();
+    fetchMyRank();
   }, [timeFilter, categoryFilter]);
 
   const fetchLeaderboard = async () => {
@@ -33,6 +37,7 @@ const LeaderboardPage = () => {
         }
       });
       setLeaderboard(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching leaderboard:', error);
       // Mock data for development
@@ -92,6 +97,49 @@ const LeaderboardPage = () => {
     setLoading(false);
   };
 
+  // Next page of rankings, continuing after the last entry shown
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${process.env.REACT_APP_BACKEND_URL}/api/leaderboard`, {
+        params: {
+          timeFilter,
+          categoryFilter,
+          after: nextCursor
+        }
+      });
+      setLeaderboard(previous => [...previous, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching more rankings:', error);
+    }
+    setLoadingMore(false);
+  };
+
+  const fetchMyRank = async () => {
+    // Guests have no ID token and no leaderboard entry
+    if (!currentUser || currentUser.isGuest) {
+      setMyRank(null);
+      return;
+    }
+    try {
+      const token = await currentUser.getIdToken();
+      const response = await axios.get(`${process.env.REACT_APP_BACKEND_URL}/api/leaderboard/me`, {
+        params: {
+          timeFilter,
+          categoryFilter
+        },
+        headers: {
+          Authorization: `Bearer ${token}`
+        }
+      });
+      setMyRank(response.data);
+    } catch (error) {
+      console.error('Error fetching rank:', error);
+      setMyRank(null);
+    }
+  };
+
   const getRankIcon = (rank) => {
     switch (rank) {
       case 1:
@@ -178,6 +226,33 @@ const LeaderboardPage = () => {
           </div>
         </div>
 
+        {/* Your Rank */}
+        {myRank && myRank.rank && (
+          <div className="bg-glass-effect rounded-lg p-6 mb-8 border-l-4 border-purple-500">
+            <div className="flex items-center justify-between">
+              <div className="flex items-center space-x-3">
+                <TrendingUp className="h-6 w-6 text-purple-400" />
+                <span className="text-lg font-semibold text-white">Your Rank</span>
+              </div>
+              <div className="text-right">
+                <span className="text-2xl font-bold text-white">#{myRank.rank}</span>
+                <span className="text-gray-400 ml-2">of {myRank.total}</span>
+              </div>
+            </div>
+            <div className="mt-4 space-y-1 text-sm">
+              {[...myRank.above, myRank.entry, ...myRank.below].map(user => (
+                <div
+                  key={user.id}
+                  className={`flex items-center justify-between ${user.id === myRank.entry.id ? 'text-purple-300 font-semibold' : 'text-gray-400'}`}
+                >
+                  <span>#{user.rank} {user.username}</span>
+                  <span>{user.xp} XP</span>
+                </div>
+              ))}
+            </div>
+          </div>
+        )}
+
         {/* Top 3 Podium */}
         <div className="grid grid-cols-1 md:grid-cols-3 gap-4 mb-12">
           {leaderboard.slice(0, 3).map((user, index) => (
@@ -241,7 +316,7 @@ const LeaderboardPage = () => {
               >
                 {/* Rank */}
                 <div className="flex-shrink-0 w-12 text-center">
-                  {getRankIcon(index + 1)}
+                  {getRankIcon(user.rank || index + 1)}
                 </div>
                 
                 {/* Avatar */}
@@ -283,6 +358,18 @@ const LeaderboardPage = () => {
               </div>
             ))}
           </div>
+          
+          {nextCursor && (
+            <div className="px-6 py-4 text-center border-t border-gray-700">
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="text-purple-400 hover:text-purple-300 font-semibold disabled:opacity-50"
+              >
+                {loadingMore ? 'Loading...' : 'Show more'}
+              </button>
+            </div>
+          )}
         </div>
 
         {/* Call to Action */}
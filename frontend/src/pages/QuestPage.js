@@ -22,7 +22,7 @@ import axios from 'axios';
 const QuestPage = () => {
   const { id } = useParams();
   const navigate = useNavigate();
-  const { currentUser, userProgress, updateUserProgress } = useAuth();
+  const { currentUser, userProgress, recordProgressEvent } = useAuth();
   const [quest, setQuest] = useState(null);
   const [code, setCode] = useState('');
   const [output, setOutput] = useState('');
@@ -213,17 +213,23 @@ else:
 
     setExecuting(true);
     setShowOutput(true);
+    setOutput('');
+    setTestResults([]);
     
     try {
-      const response = await axios.post(`${process.env.REACT_APP_BACKEND_URL}/api/code/execute`, {
-        code: code,
-        quest_id: id
+      const token = currentUser && !currentUser.isGuest ? await currentUser.getIdToken() : 'guest-token';
+      const result = await streamExecution(token, (event, data) => {
+        if (event === 'stdout') {
+          setOutput(previous => previous + data.data);
+        } else if (event === 'test') {
+          setTestResults(previous => [...previous, data]);
+        }
       });
       
-      setOutput(response.data.output);
-      setTestResults(response.data.test_results || []);
+      setOutput(result.output);
+      setTestResults(result.test_results || []);
       
-      if (response.data.success) {
+      if (result.success) {
         setIsCompleted(true);
         toast.success('Quest completed! 🎉');
         
@@ -240,7 +246,8 @@ else:
           toast.success(`Level up! You are now level ${newProgress.level}! 🎊`);
         }
         
-        updateUserProgress(newProgress);
+        // XP and level are awarded server-side; newProgress is only shown until it answers
+        recordProgressEvent({ type: 'quest_completed', quest_id: id }, newProgress);
       } else {
         toast.error('Some tests failed. Keep trying!');
       }
@@ -253,6 +260,65 @@ else:
     setExecuting(false);
   };
 
+  // Run code through the streaming endpoint, calling onEvent for every
+  // server-sent event and resolving with the final summary
+  const streamExecution = (token, onEvent) =>
+    streamEvents('/api/code/execute/stream', { code: code, quest_id: id }, token, 'summary', onEvent);
+  
+  // POST to a server-sent events endpoint, calling onEvent for every event
+  // and resolving with the payload of the final event
+  const streamEvents = async (path, body, token, finalEvent, onEvent) => {
+    const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}${path}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Authorization: `Bearer ${token}`
+      },
+      body: JSON.stringify(body)
+    });
+    if (!response.ok) {
+      throw new Error(`Request to ${path} failed with status ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let summary = null;
+    
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        
+        let event = 'message';
+        let data = '';
+        message.split('\n').forEach(line => {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        
+        const payload = JSON.parse(data);
+        if (event === finalEvent) {
+          summary = payload;
+        } else if (event === 'error') {
+          throw new Error(payload.detail);
+        } else {
+          onEvent(event, payload);
+        }
+      }
+    }
+    
+    if (!summary) {
+      throw new Error(`Stream from ${path} ended without a result`);
+    }
+    return summary;
+  };
+
   const mockExecuteCode = () => {
     setOutput(`Running your code...\n\n${code}\n\nOutput:\nCode executed successfully!`);
     const mockResults = quest.test_cases.map(test => ({
@@ -276,14 +342,22 @@ else:
     }
 
     try {
-      const response = await axios.post(`${process.env.REACT_APP_BACKEND_URL}/api/code/hint`, {
-        quest_id: id,
-        code: code,
-        user_progress: userProgress
-      });
-      
-      setHint(response.data.hint);
+      const token = currentUser && !currentUser.isGuest ? await currentUser.getIdToken() : 'guest-token';
       setShowHint(true);
+      // Show the hint as it is generated
+      const result = await streamEvents(
+        '/api/code/hint/stream',
+        { quest_id: id, code: code, user_progress: userProgress },
+        token,
+        'done',
+        (event, data) => {
+          if (event === 'token') {
+            setHint(previous => previous + data.text);
+          }
+        }
+      );
+      
+      setHint(result.hint);
     } catch (error) {
       console.error('Error getting hint:', error);
       // Mock hint for development